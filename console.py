@@ -1,20 +1,34 @@
 """Module containing the Uni-Art app CLI."""
 
 import argparse
+import sys
 
 from PIL import UnidentifiedImageError
 
-from image2text import ImageQueryFont, TextImage, TextVideo
+# video support (cv2) is only imported when the media is not an image
+import image2text
+from image2text import ImageQueryFont, TextImage
+from image2text.constants import LIVE_FRAME_DELIMITER
 
 
 def parse_args():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "-m", "--mode", choices=["file", "terminal"], help="Mode", required=True
+        "-m",
+        "--mode",
+        choices=["file", "terminal", "export", "live", "merge"],
+        help="Mode",
+        required=True,
     )
-    parser.add_argument("-s", "--media-source", help="Media source file", required=True)
-    parser.add_argument("-f", "--font-source", help="Font source file", required=True)
+    parser.add_argument(
+        "-s",
+        "--media-source",
+        nargs="+",
+        help="Media source file (saved video segments in order in merge mode)",
+        required=True,
+    )
+    parser.add_argument("-f", "--font-source", help="Font source file")
     parser.add_argument(
         "--charset", help="Charset (string of characters)", default="unicode"
     )
@@ -27,14 +41,49 @@ def parse_args():
     parser.add_argument("--ligatures", action="store_true", help="Use ligatures")
     parser.add_argument("--monospace", action="store_true", help="Force monospace")
     parser.add_argument("--font-size", type=int, help="Font size", default=100)
-    parser.add_argument("--char-count", type=int, help="Character count", required=True)
+    parser.add_argument(
+        "--shape-grid",
+        type=int,
+        help="Shape matching grid size (1 = average color matching)",
+        default=1,
+    )
+    parser.add_argument(
+        "--prune-tolerance",
+        type=float,
+        help="Merge glyphs whose colors differ by less than this (0-255 scale)",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--max-glyphs", type=int, help="Keep at most this many best spread glyphs"
+    )
+    parser.add_argument(
+        "--prune-priority",
+        choices=["narrowest", "ascii"],
+        help="Glyphs kept when merging similar glyphs",
+        default="narrowest",
+    )
+    parser.add_argument("--char-count", type=int, help="Character count")
     parser.add_argument("--row-spacing", type=float, help="Row spacing", default=1.0)
     parser.add_argument(
         "--distance-metric",
-        choices=["manhattan", "euclidean"],
+        choices=["manhattan", "euclidean", "cielab", "oklab"],
         help="Distance metric",
         default="manhattan",
     )
+    parser.add_argument(
+        "--ansi-color",
+        choices=["truecolor", "256"],
+        help="Color the output using ANSI escape codes",
+    )
+    parser.add_argument(
+        "--dither",
+        choices=["floyd-steinberg", "ordered"],
+        help="Dither the output to reduce banding of smooth gradients",
+    )
+    parser.add_argument(
+        "--raw-size",
+        help="Size of raw RGB frames read from stdin in live mode (WIDTHxHEIGHT)",
+    )
     parser.add_argument("--frame-rate", type=int, help="Frame rate", default=30)
     parser.add_argument(
         "--chunk-length", type=int, help="Video chunk length", default=5
@@ -42,8 +91,56 @@ def parse_args():
     parser.add_argument(
         "--buffer-size", type=int, help="Video buffer size", default=100
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream image rows to the output instead of converting the whole image first",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Number of video frames queried at once",
+        default=8,
+    )
+    parser.add_argument(
+        "--buffer-bytes",
+        type=int,
+        help="Video frame buffer limit in bytes (in addition to the buffer size)",
+    )
+    parser.add_argument(
+        "--cell-cache",
+        help="Save resized video frames to this file first, the file can be used as"
+        + " media source later to skip video decoding",
+    )
+    parser.add_argument(
+        "--start", type=int, help="Start of the saved video segment (s)", default=0
+    )
+    parser.add_argument("--end", type=int, help="End of the saved video segment (s)")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Start an interrupted video render over instead of resuming it",
+    )
+    parser.add_argument(
+        "--cpu-budget",
+        type=int,
+        help="Total number of threads used by FFmpeg and queries (default: all CPUs)",
+    )
     parser.add_argument("-d", "--destination", help="Destination file")
     args = parser.parse_args()
+    if args.mode == "merge":
+        if args.destination is None:
+            parser.error("merge mode requires a destination (-d)")
+        return args
+    if len(args.media_source) > 1:
+        parser.error("only merge mode accepts multiple media sources")
+    args.media_source = args.media_source[0]
+    if args.batch_size < 1:
+        parser.error("argument --batch-size: must be at least 1")
+    if args.font_source is None or args.char_count is None:
+        parser.error(
+            "the following arguments are required: -f/--font-source, --char-count"
+        )
     return args
 
 
@@ -53,10 +150,45 @@ def hex_to_rgb(hex_color):
     return tuple(int(hex_color[i : i + 2], 16) for i in (0, 2, 4))
 
 
+def live_convert(args, font):
+    """Convert a live stream of frames, writing delimited text frames to stdout."""
+    source = sys.stdin.buffer if args.media_source == "-" else args.media_source
+    frame_size = None
+    if args.raw_size is not None:
+        frame_size = tuple(int(value) for value in args.raw_size.lower().split("x"))
+    stream = image2text.TextStream(
+        font,
+        source,
+        frame_size,
+        args.frame_rate,
+        args.char_count,
+        args.row_spacing,
+        args.distance_metric,
+        color_mode=args.ansi_color,
+        batch_size=args.batch_size,
+        dither=args.dither,
+    )
+    try:
+        while True:
+            try:
+                frame = stream.next_frame_bytes()
+            except StopIteration:
+                break
+            sys.stdout.buffer.write(frame + LIVE_FRAME_DELIMITER)
+            sys.stdout.buffer.flush()
+    finally:
+        stream.stop()
+
+
 def main():
     """Main function of the CLI."""
     args = parse_args()
-    if args.destination is None:
+    if args.mode == "merge":
+        image2text.TextVideo.merge(args.media_source, args.destination)
+        return
+    if args.cpu_budget is not None:
+        image2text.set_scheduler(image2text.ResourceScheduler(args.cpu_budget))
+    if args.destination is None and args.mode == "file":
         args.destination = f"{args.media_source}.txt"
     match args.charset:
         case "ascii":
@@ -77,19 +209,65 @@ def main():
         args.ligatures,
         args.monospace,
         args.font_size,
+        args.shape_grid,
+        prune_tolerance=args.prune_tolerance,
+        max_glyphs=args.max_glyphs,
+        prune_priority=args.prune_priority,
     )
-    is_image = True
-    try:
-        new_media = TextImage(
-            font,
-            args.media_source,
-            args.char_count,
-            args.row_spacing,
-            args.distance_metric,
+    if font.pruning_stats is not None:
+        stats = font.pruning_stats
+        print(
+            f"Pruned {stats['glyphs'] - stats['kept']} of {stats['glyphs']} glyphs"
+            + f" ({stats['merged']} merged, {stats['capped']} over the maximum),"
+            + f" query speedup {stats['query_speedup']:.1f}x",
+            file=sys.stderr,
         )
+    if args.mode == "live":
+        live_convert(args, font)
+        return
+    is_animated = image2text.TextAnimation.is_animated(args.media_source)
+    if args.stream and args.mode != "export" and not is_animated:
+        try:
+            TextImage.stream(
+                font,
+                args.media_source,
+                args.destination if args.mode == "file" else sys.stdout.buffer,
+                args.char_count,
+                args.row_spacing,
+                args.distance_metric,
+                header=args.mode == "file",
+                color_mode=args.ansi_color,
+                dither=args.dither,
+            )
+            return
+        except UnidentifiedImageError:
+            pass
+    is_image = not is_animated
+    try:
+        if is_animated:
+            new_media = image2text.TextAnimation(
+                font,
+                args.media_source,
+                args.frame_rate,
+                args.char_count,
+                args.row_spacing,
+                args.distance_metric,
+                args.ansi_color,
+                args.dither,
+            )
+        else:
+            new_media = TextImage(
+                font,
+                args.media_source,
+                args.char_count,
+                args.row_spacing,
+                args.distance_metric,
+                args.ansi_color,
+                args.dither,
+            )
     except UnidentifiedImageError:
         is_image = False
-        new_media = TextVideo(
+        new_media = image2text.TextVideo(
             font,
             args.media_source,
             args.frame_rate,
@@ -98,19 +276,46 @@ def main():
             args.distance_metric,
             args.chunk_length,
             args.buffer_size,
+            args.ansi_color,
+            args.buffer_bytes,
+            args.batch_size,
+            args.dither,
         )
+    if args.cell_cache is not None and isinstance(new_media, image2text.TextVideo):
+        new_media.save_cell_cache(args.cell_cache)
     match args.mode:
-        case "file":
+        case "file" if is_image:
             new_media.save(args.destination)
+        case "file" if is_animated:
+            # animations are converted at once, there is nothing to resume
+            new_media.save(args.destination, args.start, args.end)
+        case "file":
+            new_media.save(args.destination, args.start, args.end, not args.restart)
+        case "export":
+            rasterizer = image2text.TextRasterizer(font, args.row_spacing)
+            if is_image:
+                destination = args.destination or f"{args.media_source}.png"
+                rasterizer.save_image(new_media.text, destination)
+                return
+            destination = args.destination or f"{args.media_source}.mp4"
+            try:
+                rasterizer.save_video(new_media, destination)
+            finally:
+                new_media.stop()
         case "terminal":
             if is_image:
                 print(new_media.text)
                 return
-            while True:
-                try:
-                    print(new_media.next_frame())
-                except StopIteration:
-                    break
+            player = image2text.TerminalPlayer(new_media.frame_rate)
+            try:
+                frame_rate = player.play(new_media)
+            finally:
+                new_media.stop()
+            print(
+                f"Achieved {frame_rate:.1f} fps"
+                + f" ({player.dropped_frames} frames dropped)",
+                file=sys.stderr,
+            )
 
 
 if __name__ == "__main__":
@@ -1,28 +1,103 @@
 """Module containing the Uni-Art app GUI (Flask app)."""
 
 import base64
+import functools
+import hashlib
+import inspect
+import io
+import json
 import os
+import threading
+import time
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, jsonify, render_template, request
-from PIL import UnidentifiedImageError
+from PIL import Image, UnidentifiedImageError
 
-from image2text import ImageQueryFont, TextImage, TextVideo, get_system_fonts_paths
+from image2text import (
+    ImageQueryFont,
+    TextAnimation,
+    TextImage,
+    TextVideo,
+    create_preview,
+    get_scheduler,
+    get_system_fonts_paths,
+    scheduling_priority,
+)
 
 app = Flask(__name__)
 
 FONTS_DIR = "fonts/"
 MEDIA_DIR = "media/"
+CACHE_DIR = "cache/"
+CONVERT_WORKERS = 2
+CONVERT_QUEUE_SIZE = 16  # maximum number of waiting conversions
+CONVERT_FONTS = 4  # maximum number of fonts kept loaded for conversions
+CONVERT_CACHE_BYTES = 256 * 1024 * 1024  # size limit of the cached conversions
+PREVIEW_CACHE_SIZE = 256  # maximum number of media previews kept
+
+# settings omitted in a conversion request default to the ones of the library
+FONT_DEFAULTS = {
+    name: parameter.default
+    for name, parameter in inspect.signature(ImageQueryFont).parameters.items()
+}
+IMAGE_DEFAULTS = {
+    name: parameter.default
+    for name, parameter in inspect.signature(TextImage).parameters.items()
+}
 
 
 class TextMedia:
     """Class to store the current font and player."""
 
     font = None
+    font_settings = None
+    font_progress = (0, 0)  # glyphs loaded and total of a font loading progressively
+    font_loading = 0  # number of the last font loaded, older fonts report no progress
     media = None
     changing_media = False
 
 
+class ConvertService:
+    """Class to store the state of the conversion worker pool (not of the clients)."""
+
+    executor = ThreadPoolExecutor(CONVERT_WORKERS)
+    lock = threading.Lock()
+    font_lock = threading.Lock()
+    fonts: dict[str, ImageQueryFont] = {}
+    queued = 0
+    running = 0
+    completed = 0
+    cache_hits = 0
+    total_latency = 0.0
+    last_latency = 0.0
+
+
+class PreviewService:
+    """Class to store the previews of the media library, converted in the background."""
+
+    executor = ThreadPoolExecutor(1)
+    lock = threading.Lock()
+    # previews by media path, modification time and font fingerprint
+    previews: dict[tuple[str, int, str], dict] = {}
+    pending: set[tuple[str, int, str]] = set()
+
+
+def parse_charset(charset: str | None) -> set[str] | None:
+    """Parse a charset setting (ascii, unicode or the characters themselves), None
+    means all characters of the font."""
+    match charset:
+        case None:
+            return None
+        case "ascii":
+            return set(chr(i) for i in range(128))
+        case "unicode":
+            return set(chr(i) for i in range(0x110000))
+        case _:
+            return set(charset)
+
+
 @app.route("/")
 def index():
     """Index route."""
@@ -46,15 +121,58 @@ def get_fonts():
 
 @app.route("/get_media")
 def get_media():
-    """Get a list of media files."""
+    """Get a list of media files with their previews in the current font."""
+    font = TextMedia.font
+    fingerprint = None if font is None else font.fingerprint()
     media_files = []
     for media_file in os.listdir(MEDIA_DIR):
         media_path = os.path.join(MEDIA_DIR, media_file)
         if os.path.isfile(media_path) and not media_file.startswith("."):
-            media_files.append(media_path.replace("\\", "/"))
+            media_files.append(
+                {
+                    "path": media_path.replace("\\", "/"),
+                    "preview": get_preview(media_path, font, fingerprint),
+                }
+            )
     return jsonify(media_files)
 
 
+def get_preview(
+    media_path: str, font: ImageQueryFont | None, fingerprint: str | None
+) -> dict | None:
+    """Get the preview of a media file in the font, a preview that is not cached yet
+    is converted in the background (its status is pending until then)."""
+    if font is None:
+        return None
+    key = (media_path, os.stat(media_path).st_mtime_ns, fingerprint)
+    with PreviewService.lock:
+        if key in PreviewService.previews:
+            return PreviewService.previews[key]
+        if key not in PreviewService.pending:
+            PreviewService.pending.add(key)
+            PreviewService.executor.submit(convert_preview, key, font)
+    return {"status": "pending"}
+
+
+def convert_preview(key: tuple[str, int, str], font: ImageQueryFont):
+    """Convert a preview (run by the preview worker)."""
+    preview = None
+    # previews queued for a font that was replaced since are dropped
+    if font is TextMedia.font:
+        try:
+            with scheduling_priority("background"):
+                preview = {"status": "ready", "frames": create_preview(font, key[0])}
+        except Exception as e:  # pylint: disable=broad-except
+            preview = {"status": "failed", "error": str(e)}
+    with PreviewService.lock:
+        PreviewService.pending.discard(key)
+        if preview is None:
+            return
+        if len(PreviewService.previews) >= PREVIEW_CACHE_SIZE:
+            del PreviewService.previews[next(iter(PreviewService.previews))]
+        PreviewService.previews[key] = preview
+
+
 @app.route("/set_font", methods=["POST"])
 def set_font():
     """Set the font to be used."""
@@ -63,14 +181,7 @@ def set_font():
         return jsonify(success=False, error="Unknown error")
     try:
         font_path = font_data["font"]
-        charset = font_data["charset"]
-        match charset:
-            case "ascii":
-                charset = set(chr(i) for i in range(128))
-            case "unicode":
-                charset = set(chr(i) for i in range(0x110000))
-            case _:
-                charset = set(charset)
+        charset = parse_charset(font_data["charset"])
         text_color = tuple(font_data["textColor"])
         background_color = tuple(font_data["backgroundColor"])
         embedded_color = font_data["embeddedColor"]
@@ -78,18 +189,56 @@ def set_font():
         ligatures = font_data["ligatures"]
         force_monospace = font_data["forceMonospace"]
         render_size = int(font_data["renderSize"])
-        new_font = ImageQueryFont(
+        shape_grid = int(font_data["shapeGrid"])
+        prune_tolerance = float(font_data.get("pruneTolerance", 0))
+        # 0 (or nothing) means no limit
+        max_glyphs = int(font_data.get("maxGlyphs") or 0) or None
+        prune_priority = font_data.get("prunePriority", "narrowest")
+        font_settings = (
             font_path,
-            charset,
-            text_color,
-            background_color,
+            font_data["charset"],
             embedded_color,
             kerning,
             ligatures,
             force_monospace,
             render_size,
+            shape_grid,
+            prune_tolerance,
+            max_glyphs,
+            prune_priority,
         )
+        if TextMedia.font is not None and TextMedia.font_settings == font_settings:
+            # only colors changed, no need to render all the glyphs again
+            new_font = TextMedia.font
+            new_font.recolor(text_color, background_color)
+        else:
+            if TextMedia.font is not None:
+                TextMedia.font.stop_loading()
+            TextMedia.font_loading += 1
+            # the font is usable after rendering a subset of the glyphs, the rest are
+            # rendered in the background
+            new_font = ImageQueryFont(
+                font_path,
+                charset,
+                text_color,
+                background_color,
+                embedded_color,
+                kerning,
+                ligatures,
+                force_monospace,
+                render_size,
+                shape_grid,
+                prune_tolerance=prune_tolerance,
+                max_glyphs=max_glyphs,
+                prune_priority=prune_priority,
+                progressive=True,
+                progress_callback=functools.partial(
+                    report_font_progress, TextMedia.font_loading
+                ),
+            )
+            TextMedia.font_progress = (len(new_font.coverage_dict), new_font.num_glyphs)
         TextMedia.font = new_font
+        TextMedia.font_settings = font_settings
         if TextMedia.media is not None:
             TextMedia.media.change_font(new_font)
         with open(font_path, "rb") as font_file:
@@ -98,7 +247,39 @@ def set_font():
     except Exception as e:  # pylint: disable=broad-except
         return jsonify(success=False, error=str(e))
     return jsonify(
-        success=True, fontData=font_data, loadedChars=TextMedia.font.num_characters
+        success=True,
+        fontData=font_data,
+        loadedChars=TextMedia.font.num_characters,
+        complete=TextMedia.font.is_complete,
+    )
+
+
+def report_font_progress(font_loading: int, loaded: int, total: int):
+    """Store the progress of the font loading in the background, once all glyphs are
+    loaded media converted in advance (images, animations) is converted again."""
+    if font_loading != TextMedia.font_loading:
+        # a batch of a replaced font finishing after the new font was set
+        return
+    TextMedia.font_progress = (loaded, total)
+    if loaded == total and TextMedia.font is not None and TextMedia.font.is_complete:
+        if isinstance(TextMedia.media, (TextImage, TextAnimation)):
+            TextMedia.media.change_font(TextMedia.font)
+
+
+@app.route("/font_progress")
+def font_progress():
+    """Get the progress of loading the glyphs of the current font."""
+    if TextMedia.font is None:
+        return jsonify(success=False, error="No font loaded")
+    if TextMedia.font.loading_error is not None:
+        return jsonify(success=False, error=TextMedia.font.loading_error)
+    loaded, total = TextMedia.font_progress
+    return jsonify(
+        success=True,
+        loaded=loaded,
+        total=total,
+        complete=TextMedia.font.is_complete,
+        loadedChars=TextMedia.font.num_characters,
     )
 
 
@@ -123,17 +304,31 @@ def set_media():
         frame_rate = int(media_data["frameRate"])
         chunk_length = int(media_data["chunkLength"])
         buffer_size = int(media_data["bufferSize"])
-        if isinstance(TextMedia.media, TextVideo):
+        if isinstance(TextMedia.media, (TextVideo, TextAnimation)):
             TextMedia.media.stop()
         try:
-            new_media = TextImage(
-                TextMedia.font,
-                media_path,
-                character_count,
-                row_spacing,
-                distance_metric,
-            )
-            detected_type = "image"
+            if TextAnimation.is_animated(media_path):
+                # animated images are played as videos, but without FFmpeg
+                new_media = TextAnimation(
+                    TextMedia.font,
+                    media_path,
+                    frame_rate,
+                    character_count,
+                    row_spacing,
+                    distance_metric,
+                )
+                detected_type = "video"
+            else:
+                # tweaking the parameters converts the same image again
+                new_media = TextImage(
+                    TextMedia.font,
+                    media_path,
+                    character_count,
+                    row_spacing,
+                    distance_metric,
+                    cache=True,
+                )
+                detected_type = "image"
         except UnidentifiedImageError:
             new_media = TextVideo(
                 TextMedia.font,
@@ -160,7 +355,7 @@ def get_frame():
     try:
         if isinstance(TextMedia.media, TextImage):
             frame = TextMedia.media.text
-        elif isinstance(TextMedia.media, TextVideo):
+        elif isinstance(TextMedia.media, (TextVideo, TextAnimation)):
             try:
                 frame = TextMedia.media.next_frame()
             except StopIteration:
@@ -184,13 +379,233 @@ def set_time():
         return jsonify(success=False, error="Unknown error")
     try:
         time = time_data["time"]
-        if isinstance(TextMedia.media, TextVideo):
+        if isinstance(TextMedia.media, (TextVideo, TextAnimation)):
             TextMedia.media.set_time(time)
     except Exception as e:  # pylint: disable=broad-except
         return jsonify(success=False, error=str(e))
     return jsonify(success=True)
 
 
+def get_convert_font(font_settings: dict, font_hash: str) -> ImageQueryFont:
+    """Get a loaded font for conversion, loading it if necessary."""
+    fingerprint = hashlib.sha256(
+        (font_hash + json.dumps(font_settings, sort_keys=True)).encode("utf-8")
+    ).hexdigest()
+    # fonts are loaded one at a time, so the same font is never loaded twice
+    with ConvertService.font_lock:
+        font = ConvertService.fonts.get(fingerprint)
+        if font is None:
+            font = ImageQueryFont(
+                font_settings["font"],
+                parse_charset(font_settings["charset"]),
+                tuple(font_settings["textColor"]),
+                tuple(font_settings["backgroundColor"]),
+                font_settings["embeddedColor"],
+                font_settings["kerning"],
+                font_settings["ligatures"],
+                font_settings["forceMonospace"],
+                font_settings["renderSize"],
+                font_settings["shapeGrid"],
+                prune_tolerance=font_settings["pruneTolerance"],
+                max_glyphs=font_settings["maxGlyphs"],
+                prune_priority=font_settings["prunePriority"],
+            )
+            if len(ConvertService.fonts) >= CONVERT_FONTS:
+                del ConvertService.fonts[next(iter(ConvertService.fonts))]
+            ConvertService.fonts[fingerprint] = font
+    return font
+
+
+def convert_image(
+    media: bytes, font_settings: dict, font_hash: str, settings: dict, path: str
+) -> str:
+    """Convert an image to text and save it to the cache (runs in a worker)."""
+    with ConvertService.lock:
+        ConvertService.queued -= 1
+        ConvertService.running += 1
+    try:
+        font = get_convert_font(font_settings, font_hash)
+        # playback of the player keeps priority over conversions
+        with scheduling_priority("background"):
+            text = TextImage(
+                font,
+                Image.open(io.BytesIO(media)),
+                settings["characterCount"],
+                settings["rowSpacing"],
+                settings["distanceMetric"],
+                settings["colorMode"],
+            ).text
+        # written under a temporary name first, so a partial result is never read
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_path, path)
+        trim_convert_cache()
+        return text
+    finally:
+        with ConvertService.lock:
+            ConvertService.running -= 1
+
+
+def trim_convert_cache():
+    """Remove the least recently used conversions while the cache is over its size
+    limit."""
+    entries = []
+    with os.scandir(CACHE_DIR) as cache_entries:
+        for entry in cache_entries:
+            if not entry.name.endswith(".txt"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    cache_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if cache_bytes <= CONVERT_CACHE_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # removed by another worker trimming at the same time
+            pass
+        cache_bytes -= size
+
+
+@app.route("/convert", methods=["POST"])
+def convert():
+    """Convert an image to text without using or changing the player state.
+
+    Accepts either a multipart form with the image file as "media" and the settings
+    as JSON in "settings", or JSON settings with a media path in "media". Results are
+    cached on disk by a hash of the image, the font and the settings.
+    """
+    start_time = time.perf_counter()
+    try:
+        if "media" in request.files:
+            settings = json.loads(request.form.get("settings", "{}"))
+            media = request.files["media"].read()
+        else:
+            settings = request.json
+            if settings is None:
+                return jsonify(success=False, error="Unknown error"), 400
+            with open(settings["media"], "rb") as media_file:
+                media = media_file.read()
+        font_settings = {
+            "font": settings["font"],
+            "charset": settings.get("charset"),
+            "textColor": list(settings.get("textColor", FONT_DEFAULTS["text_color"])),
+            "backgroundColor": list(
+                settings.get("backgroundColor", FONT_DEFAULTS["bg_color"])
+            ),
+            "embeddedColor": bool(
+                settings.get("embeddedColor", FONT_DEFAULTS["use_embedded_color"])
+            ),
+            "kerning": bool(settings.get("kerning", FONT_DEFAULTS["use_kerning"])),
+            "ligatures": bool(
+                settings.get("ligatures", FONT_DEFAULTS["use_ligatures"])
+            ),
+            "forceMonospace": bool(
+                settings.get("forceMonospace", FONT_DEFAULTS["force_monospace"])
+            ),
+            "renderSize": int(
+                settings.get("renderSize", FONT_DEFAULTS["font_render_size"])
+            ),
+            "shapeGrid": int(settings.get("shapeGrid", FONT_DEFAULTS["shape_grid"])),
+            "pruneTolerance": float(
+                settings.get("pruneTolerance", FONT_DEFAULTS["prune_tolerance"])
+            ),
+            "maxGlyphs": int(settings.get("maxGlyphs") or 0) or None,
+            "prunePriority": settings.get(
+                "prunePriority", FONT_DEFAULTS["prune_priority"]
+            ),
+        }
+        conversion_settings = {
+            # the only setting without a library default
+            "characterCount": int(settings.get("characterCount", 5000)),
+            "rowSpacing": float(
+                settings.get("rowSpacing", IMAGE_DEFAULTS["row_spacing"])
+            ),
+            "distanceMetric": settings.get(
+                "distanceMetric", IMAGE_DEFAULTS["distance_metric"]
+            ),
+            "colorMode": settings.get("colorMode", IMAGE_DEFAULTS["color_mode"]),
+        }
+        with open(font_settings["font"], "rb") as font_file:
+            font_hash = hashlib.sha256(font_file.read()).hexdigest()
+        key = hashlib.sha256()
+        key.update(hashlib.sha256(media).digest())
+        key.update(font_hash.encode("utf-8"))
+        key.update(
+            json.dumps([font_settings, conversion_settings], sort_keys=True).encode(
+                "utf-8"
+            )
+        )
+        path = os.path.join(CACHE_DIR, key.hexdigest() + ".txt")
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                text = file.read()
+            # results that are used are the last to be removed from the cache
+            os.utime(path)
+        except FileNotFoundError:
+            text = None
+        if text is not None:
+            with ConvertService.lock:
+                ConvertService.cache_hits += 1
+            return jsonify(success=True, text=text, cached=True)
+        with ConvertService.lock:
+            if ConvertService.queued >= CONVERT_QUEUE_SIZE:
+                return jsonify(success=False, error="Conversion queue is full"), 503
+            ConvertService.queued += 1
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        future = ConvertService.executor.submit(
+            convert_image, media, font_settings, font_hash, conversion_settings, path
+        )
+        text = future.result()
+    except Exception as e:  # pylint: disable=broad-except
+        return jsonify(success=False, error=str(e)), 400
+    latency = time.perf_counter() - start_time
+    with ConvertService.lock:
+        ConvertService.completed += 1
+        ConvertService.total_latency += latency
+        ConvertService.last_latency = latency
+    return jsonify(success=True, text=text, cached=False)
+
+
+@app.route("/convert_stats")
+def convert_stats():
+    """Get the queue depth and latency of the conversion worker pool."""
+    with ConvertService.lock:
+        completed = ConvertService.completed
+        return jsonify(
+            queued=ConvertService.queued,
+            running=ConvertService.running,
+            workers=CONVERT_WORKERS,
+            completed=completed,
+            cacheHits=ConvertService.cache_hits,
+            averageLatency=(
+                ConvertService.total_latency / completed if completed else 0.0
+            ),
+            lastLatency=ConvertService.last_latency,
+            scheduler=get_scheduler().stats(),
+        )
+
+
+def get_memory_usage() -> int | None:
+    """Get the resident memory of the server process in bytes (None if unknown)."""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@app.route("/server_stats")
+def server_stats():
+    """Get the memory usage and the number of threads of the server process."""
+    return jsonify(memory=get_memory_usage(), threads=threading.active_count())
+
+
 if __name__ == "__main__":
     if not os.path.exists(FONTS_DIR):
         os.makedirs(FONTS_DIR)
@@ -1,17 +1,54 @@
 """query_font module"""
 
-from .helpers import get_system_fonts_paths, query_benchmark
-from .helpers import ready_render_temp as _ready_render_temp
-from .image_convert import TextImage
-from .image_query_font import ImageQueryFont
-from .video_convert import TextVideo
+import importlib
 
-_ready_render_temp()
+# public names and submodules defining them, submodules (and their heavy dependencies
+# like cv2, scipy or fontTools) are only imported on first access
+_LAZY_ATTRIBUTES = {
+    "ImageQueryFont": ".image_query_font",
+    "TextImage": ".image_convert",
+    "TextVideo": ".video_convert",
+    "TextStream": ".stream_convert",
+    "TextAnimation": ".animation_convert",
+    "TerminalPlayer": ".terminal_player",
+    "TextRasterizer": ".rasterizer",
+    "create_preview": ".preview",
+    "ResourceScheduler": ".scheduler",
+    "get_scheduler": ".scheduler",
+    "set_scheduler": ".scheduler",
+    "scheduling_priority": ".scheduler",
+    "query_benchmark": ".helpers",
+    "query_memory_benchmark": ".helpers",
+    "get_system_fonts_paths": ".helpers",
+}
 
 __all__ = [
     "ImageQueryFont",
     "TextImage",
     "TextVideo",
+    "TextStream",
+    "TextAnimation",
+    "TerminalPlayer",
+    "TextRasterizer",
+    "create_preview",
+    "ResourceScheduler",
+    "get_scheduler",
+    "set_scheduler",
+    "scheduling_priority",
     "query_benchmark",
+    "query_memory_benchmark",
     "get_system_fonts_paths",
 ]
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,206 @@
+"""Module for converting animated images (GIF, WebP, APNG) to text."""
+
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from .constants import (
+    BYTE_ORDER,
+    DEFAULT_FRAME_DURATION,
+    INT_SIZE,
+    QUERY_BATCH_SIZE,
+    TEXT_VIDEO_MAGIC_NUMBER,
+)
+from .helpers import estimate_new_size, resize_image
+from .image_query_font import ImageQueryFont
+from .scheduler import get_scheduler
+
+
+class TextAnimation:
+    """Class for converting animated images to text, frames are decoded by PIL and
+    converted all at once, so no FFmpeg process or temp files are needed."""
+
+    def __init__(
+        self,
+        font: ImageQueryFont,
+        animation: str,
+        frame_rate: int = 30,
+        num_characters_per_frame: int = 5000,
+        row_spacing: float = 1.0,
+        distance_metric: str = "manhattan",
+        color_mode: str | None = None,
+        dither: str | None = None,
+        workers: int | None = None,
+    ):
+        """Function to convert an animated image to text using a font.
+
+        Args:
+            font (ImageQueryFont): Font to use for conversion.
+            animation (str): Path to the animated image.
+            frame_rate (int, optional): Frame rate of the playback, frame durations of
+            the animation are resampled to it. Defaults to 30.
+            num_characters_per_frame (int, optional): Approximate number of characters
+            per frame. Defaults to 5000.
+            row_spacing (float, optional): Spacing between rows. Defaults to 1.0.
+            distance_metric (str, optional): Distance metric to be used for query.
+            Defaults to "manhattan".
+            color_mode (str | None, optional): ANSI color mode of the output, either
+            "truecolor", "256" or None for plain text. Defaults to None.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" or "ordered". Defaults to None.
+            workers (int | None, optional): Number of threads converting the frames.
+            Defaults to None (CPU budget of the shared scheduler).
+        """
+        self.frame_rate = frame_rate
+        self.distance_metric = distance_metric
+        self.color_mode = color_mode
+        self.dither = dither
+        self.workers = workers
+        with Image.open(animation) as image:
+            new_size = estimate_new_size(
+                font, image.size, num_characters_per_frame, row_spacing
+            )
+            # identical frames (common in GIFs) are converted only once
+            unique_frames = {}
+            cell_frames = []
+            frame_ids = []
+            durations = []
+            for frame in ImageSequence.Iterator(image):
+                frame_array = resize_image(frame.convert("RGB"), new_size)
+                key = hashlib.sha1(frame_array.tobytes()).digest()
+                if key not in unique_frames:
+                    unique_frames[key] = len(cell_frames)
+                    cell_frames.append(frame_array)
+                frame_ids.append(unique_frames[key])
+                durations.append(frame.info.get("duration") or DEFAULT_FRAME_DURATION)
+        # a single array, so batches of frames are queried without being stacked
+        self.cell_frames = np.stack(cell_frames)
+        # converted frame shown at each frame of the playback (durations are in ms)
+        frame_ends = np.cumsum(durations)
+        self.video_length = frame_ends[-1] / 1000
+        playback_times = (
+            np.arange(max(1, round(self.video_length * frame_rate))) * 1000 / frame_rate
+        )
+        self.frame_indices = np.array(frame_ids)[
+            np.searchsorted(frame_ends, playback_times, side="right")
+        ]
+        self.frame_count = len(self.frame_indices)
+        self.change_font(font)
+        self._frame_number = 0
+        self._stopped = False
+
+    @staticmethod
+    def is_animated(path: str) -> bool:
+        """Function to check whether a file is an animated image (with multiple frames).
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            bool: True if the file is an animated image.
+        """
+        try:
+            with Image.open(path) as image:
+                return getattr(image, "n_frames", 1) > 1
+        except (OSError, ValueError):
+            return False
+
+    def change_font(self, font: ImageQueryFont, distance_metric: str | None = None):
+        """Change the font (and optionally distance metric) of the animation, all
+        frames are converted again right away.
+
+        Args:
+            font (ImageQueryFont): New font to use.
+            distance_metric (str | None, optional): New distance metric to use.
+            Defaults to None (keep the current one).
+        """
+        self.font = font
+        if distance_metric is not None:
+            self.distance_metric = distance_metric
+        batches = [
+            self.cell_frames[start : start + QUERY_BATCH_SIZE]
+            for start in range(0, len(self.cell_frames), QUERY_BATCH_SIZE)
+        ]
+        # queries of the workers share the CPU budget with the priority of the caller
+        with ThreadPoolExecutor(self.workers or get_scheduler().budget) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    font.query_batch,
+                    batch,
+                    self.distance_metric,
+                    self.color_mode,
+                    self.dither,
+                )
+                for batch in batches
+            ]
+            self.frames = [
+                text.encode("utf-8")
+                for future in futures
+                for text in future.result()
+            ]
+
+    def set_time(self, new_time: int):
+        """Set the time of the animation.
+
+        Args:
+            new_time (int): New time in seconds.
+        """
+        if self._stopped:
+            raise ValueError("Animation player has been stopped")
+        if 0 <= new_time < self.video_length:
+            self._frame_number = int(new_time * self.frame_rate)
+
+    def next_frame(self) -> str:
+        """Get the next frame of the animation.
+
+        Returns:
+            str: Next frame of the animation.
+        """
+        return self.next_frame_bytes().decode("utf-8")
+
+    def next_frame_bytes(self) -> bytes:
+        """Get the next frame of the animation without decoding it.
+
+        Returns:
+            bytes: Next frame of the animation (UTF-8 encoded).
+        """
+        if self._stopped:
+            raise ValueError("Animation player has been stopped")
+        if self._frame_number >= self.frame_count:
+            raise StopIteration
+        frame_bytes = self.frames[self.frame_indices[self._frame_number]]
+        self._frame_number += 1
+        return frame_bytes
+
+    def stop(self):
+        """Stop the animation player (cannot be resumed)."""
+        self._stopped = True
+
+    def save(self, path: str, start_time: int = 0, end_time: int | None = None):
+        """Function to save the animation (or only a segment of it) to a file in the
+        saved video format.
+
+        Args:
+            path (str): Path to save the animation.
+            start_time (int, optional): Start of the segment in seconds. Defaults to 0.
+            end_time (int | None, optional): End of the segment in seconds (exclusive).
+            Defaults to None (end of the animation).
+        """
+        start = min(self.frame_count, start_time * self.frame_rate)
+        end = self.frame_count if end_time is None else end_time * self.frame_rate
+        frames = [self.frames[i] for i in self.frame_indices[start : max(start, end)]]
+        with open(path, "wb") as file:
+            file.write(TEXT_VIDEO_MAGIC_NUMBER.to_bytes(INT_SIZE, BYTE_ORDER))
+            file.write(self.frame_rate.to_bytes(INT_SIZE, BYTE_ORDER))
+            file.write(len(frames).to_bytes(INT_SIZE, BYTE_ORDER))
+            offset = 3 * INT_SIZE + len(frames) * INT_SIZE
+            for frame in frames:
+                file.write(offset.to_bytes(INT_SIZE, BYTE_ORDER))
+                offset += INT_SIZE + len(frame)
+            for frame in frames:
+                file.write(len(frame).to_bytes(INT_SIZE, BYTE_ORDER))
+                file.write(frame)
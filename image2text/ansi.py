@@ -0,0 +1,77 @@
+"""Module for coloring text output using ANSI escape codes."""
+
+import numpy as np
+
+ANSI_RESET = "\x1b[0m"
+COLOR_MODES = ("truecolor", "256")
+
+
+def check_color_mode(color_mode: str | None):
+    """Function to check whether the color mode is valid.
+
+    Args:
+        color_mode (str | None): Color mode to check.
+
+    Raises:
+        ValueError: If the color mode is not None or one of COLOR_MODES.
+    """
+    if color_mode is not None and color_mode not in COLOR_MODES:
+        raise ValueError(f"Invalid color mode, use one of: {' '.join(COLOR_MODES)}")
+
+
+def quantize_colors(colors: np.ndarray, color_mode: str) -> np.ndarray:
+    """Function to quantize RGB colors to integer color codes.
+
+    Args:
+        colors (np.ndarray): Array of RGB colors (..., 3).
+        color_mode (str): Either "truecolor" (24 bit codes) or "256" (xterm palette).
+
+    Returns:
+        np.ndarray: Array of color codes (...).
+    """
+    colors = np.asarray(colors, dtype=np.int32).clip(0, 255)
+    if color_mode == "truecolor":
+        return colors[..., 0] << 16 | colors[..., 1] << 8 | colors[..., 2]
+    # nearest level of the xterm 6x6x6 color cube (0, 95, 135, 175, 215, 255)
+    levels = np.where(colors < 48, 0, np.where(colors < 115, 1, (colors - 35) // 40))
+    return 16 + 36 * levels[..., 0] + 6 * levels[..., 1] + levels[..., 2]
+
+
+def color_escape(code: int, color_mode: str) -> str:
+    """Function to create a foreground color escape code.
+
+    Args:
+        code (int): Color code created by quantize_colors.
+        color_mode (str): Color mode used to create the code.
+
+    Returns:
+        str: ANSI escape code.
+    """
+    if color_mode == "truecolor":
+        return f"\x1b[38;2;{code >> 16};{code >> 8 & 255};{code & 255}m"
+    return f"\x1b[38;5;{code}m"
+
+
+def colorize_row(
+    chars: list[str], codes: np.ndarray, color_mode: str, separator: str = ""
+) -> str:
+    """Function to join a row of characters, coloring them with ANSI escape codes.
+    Runs of characters with the same color code share a single escape code.
+
+    Args:
+        chars (list[str]): Characters of the row.
+        codes (np.ndarray): Color code of each character.
+        color_mode (str): Color mode used to create the codes.
+        separator (str, optional): Separator between characters. Defaults to "".
+
+    Returns:
+        str: Colored row (ending with a reset code).
+    """
+    if not chars:
+        return ""
+    codes = np.asarray(codes)
+    run_starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    chars = list(chars)
+    for start in run_starts:
+        chars[start] = color_escape(int(codes[start]), color_mode) + chars[start]
+    return separator.join(chars) + ANSI_RESET
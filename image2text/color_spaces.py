@@ -0,0 +1,107 @@
+"""Module for converting sRGB colors to perceptual color spaces."""
+
+import numpy as np
+
+COLOR_SPACES = ("cielab", "oklab")
+
+# sRGB to linear RGB for each of the 256 channel values
+_LINEAR_TABLE = np.where(
+    np.arange(256) <= 10,
+    np.arange(256) / 255 / 12.92,
+    ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4,
+).astype(np.float32)
+
+# linear RGB to XYZ divided by the D65 white point
+_RGB_TO_XYZ = (
+    np.array(
+        [
+            [0.4124564, 0.3575761, 0.1804375],
+            [0.2126729, 0.7151522, 0.0721750],
+            [0.0193339, 0.1191920, 0.9503041],
+        ]
+    )
+    / np.array([[0.95047], [1.0], [1.08883]])
+).astype(np.float32)
+_XYZ_TO_LAB = np.array(
+    [[0.0, 116.0, 0.0], [500.0, -500.0, 0.0], [0.0, 200.0, -200.0]], dtype=np.float32
+)
+_RGB_TO_LMS = np.array(
+    [
+        [0.4122214708, 0.5363325363, 0.0514459929],
+        [0.2119034982, 0.6806995451, 0.1073969566],
+        [0.0883024619, 0.2817188376, 0.6299787005],
+    ],
+    dtype=np.float32,
+)
+_LMS_TO_OKLAB = np.array(
+    [
+        [0.2104542553, 0.7936177850, -0.0040720468],
+        [1.9779984951, -2.4285922050, 0.4505937099],
+        [0.0259040371, 0.7827308773, -0.8086757660],
+    ],
+    dtype=np.float32,
+)
+
+
+def check_color_space(color_space: str | None):
+    """Function to check whether the color space is valid.
+
+    Args:
+        color_space (str | None): Color space to check.
+
+    Raises:
+        ValueError: If the color space is not None or one of COLOR_SPACES.
+    """
+    if color_space is not None and color_space not in COLOR_SPACES:
+        raise ValueError(f"Invalid color space, use one of: {' '.join(COLOR_SPACES)}")
+
+
+def to_linear(colors: np.ndarray) -> np.ndarray:
+    """Function to convert sRGB colors (0-255) to linear RGB (0-1). Integer colors
+    are converted by a table lookup, other colors by the sRGB transfer function.
+
+    Args:
+        colors (np.ndarray): Array of sRGB colors (..., 3).
+
+    Returns:
+        np.ndarray: Array of linear RGB colors (..., 3) as float32.
+    """
+    if colors.dtype == np.uint8:
+        return _LINEAR_TABLE[colors]
+    colors = np.clip(colors, 0, 255).astype(np.float32) / 255
+    return np.where(
+        colors <= 0.04045, colors / 12.92, ((colors + 0.055) / 1.055) ** 2.4
+    ).astype(np.float32)
+
+
+def to_color_space(colors: np.ndarray, color_space: str) -> np.ndarray:
+    """Function to convert sRGB colors to a perceptual color space, in which euclidean
+    distance approximates perceived color difference.
+
+    Args:
+        colors (np.ndarray): Array of sRGB colors (..., 3), 0-255.
+        color_space (str): Either "cielab" (L 0-100) or "oklab" (scaled to L 0-100,
+        so both spaces have comparable ranges).
+
+    Returns:
+        np.ndarray: Array of converted colors (..., 3) as float32.
+    """
+    # converted in two buffers (the linear colors and the intermediate space)
+    # instead of a new array per step
+    result = to_linear(colors)
+    flat = result.reshape(-1, 3)
+    if color_space == "oklab":
+        lms = np.matmul(flat, _RGB_TO_LMS.T)
+        np.cbrt(lms, out=lms)
+        np.matmul(lms, _LMS_TO_OKLAB.T * 100, out=flat)
+        return result
+    xyz = np.matmul(flat, _RGB_TO_XYZ.T)
+    # cube root with the linear segment near black (CIE 1976)
+    is_cube_root = xyz > 216 / 24389
+    np.cbrt(xyz, out=flat)
+    xyz *= 24389 / 27 / 116
+    xyz += 16 / 116
+    np.copyto(xyz, flat, where=is_cube_root)
+    np.matmul(xyz, _XYZ_TO_LAB.T, out=flat)
+    flat[:, 0] -= 16
+    return result
@@ -16,12 +16,34 @@ match sys.platform:
         SYSTEM_FONT_PATH = ""
 
 LOOKUP_TYPE_LIGATURE = 4
+SHAPE_COMPONENTS = 8  # PCA components kept for shape matching
+PROGRESSIVE_SUBSET_SIZE = 256  # glyphs rendered before a progressive font is usable
+PROGRESSIVE_BATCH_SIZE = 64  # glyphs rendered per step of the background build
 
-RENDER_TEMP_DIR = "render_temp"
+RENDER_TEMP_PREFIX = "uni_art_"  # per-process render temp directory prefix
+RENDER_MANIFEST_SUFFIX = ".manifest.json"  # checkpoint of a render being saved
+RENDER_MANIFEST_VERSION = 1
+TILED_RESIZE_PIXELS = 4096 * 4096  # images larger than this are resized in bands
+RESIZE_TILE_ROWS = 64  # output rows per resize band
+REDUCING_GAP = 2.0  # see PIL.Image.resize
+IMAGE_CACHE_BYTES = 256 * 1024 * 1024  # decoded image pyramids kept for re-conversion
+IMAGE_PYRAMID_MIN_SIZE = 64  # smallest side of the smallest pyramid level
+QUERY_TILE_ROWS = 64  # rows per query tile when streaming
+QUERY_BATCH_SIZE = 8  # video frames queried at once
+QUERY_CHUNK_SIZE = 1 << 16  # points per kd-tree query (bounds its float64 copies)
+QUERY_THREAD_POINTS = 1 << 13  # kd-tree points per query thread
+INTERACTIVE_SHARE = 0.25  # share of the CPU budget background work never uses
+PIPE_THREADS_SHARE = 0.5  # share of the CPU budget requested by FFmpeg pipes
+LIVE_FRAME_DELIMITER = b"\x0c"  # form feed, never a part of a frame (see charsets)
 PROCESS_REFRESH_RATE = 0.1  # seconds
+DEFAULT_FRAME_DURATION = 100  # ms, for animation frames without a duration
+PREVIEW_CHARACTER_COUNT = 400  # characters per frame of media previews
+PREVIEW_FRAME_COUNT = 4  # evenly spaced frames of animation and video previews
 
 TEXT_IMAGE_MAGIC_NUMBER = 157450653
 TEXT_VIDEO_MAGIC_NUMBER = 94987465
+CELL_CACHE_MAGIC_NUMBER = 61834907
 
 BYTE_ORDER = "big"
 INT_SIZE = 4
+CELL_CACHE_HEADER_SIZE = 5 * INT_SIZE
@@ -0,0 +1,126 @@
+"""Module for dithering images before (ordered) or during (error diffusion) query."""
+
+import numpy as np
+from scipy.spatial import KDTree
+
+DITHER_MODES = ("floyd-steinberg", "ordered")
+
+# 4x4 Bayer matrix thresholds centered around 0 (-0.47 to 0.47)
+BAYER_MATRIX = (
+    np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]) + 0.5
+) / 16 - 0.5
+
+
+def check_dither_mode(dither: str | None):
+    """Function to check whether the dither mode is valid.
+
+    Args:
+        dither (str | None): Dither mode to check.
+
+    Raises:
+        ValueError: If the dither mode is not None or one of DITHER_MODES.
+    """
+    if dither is not None and dither not in DITHER_MODES:
+        raise ValueError(f"Invalid dither mode, use one of: {' '.join(DITHER_MODES)}")
+
+
+def ordered_dither(
+    image: np.ndarray,
+    spread: float,
+    cell_size: int = 1,
+    frame_rows: int | None = None,
+) -> np.ndarray:
+    """Function to add Bayer matrix thresholds to all channels of an RGB image.
+
+    Args:
+        image (np.ndarray): RGB image (0-255).
+        spread (float): Amplitude of the thresholds, about the distance between
+        neighbouring colors the image is quantized to.
+        cell_size (int, optional): Size of the cells sharing a threshold (pixels of a
+        character cell). Defaults to 1.
+        frame_rows (int | None, optional): Number of cell rows of each of the stacked
+        frames, the pattern starts over in every frame. Defaults to None (one frame).
+
+    Returns:
+        np.ndarray: Dithered image as float.
+    """
+    rows = np.arange(image.shape[0]) // cell_size
+    if frame_rows is not None:
+        rows %= frame_rows
+    rows %= 4
+    cols = np.arange(image.shape[1]) // cell_size % 4
+    offsets = BAYER_MATRIX[rows[:, None], cols[None, :]] * spread
+    return np.clip(image + offsets[..., None], 0, 255)
+
+
+def diffuse_errors(
+    features: np.ndarray,
+    kdtree: KDTree,
+    distance_metric: int,
+    frame_rows: int | None = None,
+) -> np.ndarray:
+    """Function to query a grid of cells with Floyd-Steinberg error diffusion. Cells
+    only depend on the cell to the left and the three cells above, so all cells on a
+    wavefront (column + 2 * row is constant) are queried at once. That is the longest
+    chain of cells depending on each other, so the number of queries can't be lower
+    without changing the result, each step only does a few numpy calls besides it.
+
+    Args:
+        features (np.ndarray): Query features of the cells (rows, cols, features).
+        kdtree (KDTree): Kd-tree to query, its last point is the out of bounds dummy.
+        distance_metric (int): Minkowski p of the query.
+        frame_rows (int | None, optional): Number of rows of each of the stacked
+        frames, errors are not diffused across frames. Defaults to None (one frame).
+
+    Returns:
+        np.ndarray: Indices of the matched points (rows, cols).
+    """
+    rows, cols, dims = features.shape
+    if rows == 0 or cols == 0:
+        return np.empty((rows, cols), dtype=np.intp)
+    frame_rows = rows if frame_rows is None else frame_rows
+    num_frames = rows // frame_rows
+    # every frame gets an empty row below it and every row an empty column on both
+    # sides, errors diffused out of the frame land there, so no step needs bounds
+    # checks (the copy also receives the diffused errors)
+    width = cols + 2
+    padded = np.zeros((num_frames, frame_rows + 1, width, dims))
+    padded[:, :frame_rows, 1:-1] = features.reshape(num_frames, frame_rows, cols, dims)
+    padded = padded.reshape(-1, dims)
+    points = kdtree.data
+    # clipping to the range of the points (without the dummy) keeps errors bounded
+    low, high = points[:-1].min(axis=0), points[:-1].max(axis=0)
+    local_rows = np.arange(rows) % frame_rows
+    padded_rows = np.arange(rows) + np.arange(rows) // frame_rows
+    positions = padded_rows[:, None] * width + np.arange(1, cols + 1)
+    # cells sorted by their wavefront, each step is a slice of them
+    steps = (np.arange(cols) + 2 * local_rows[:, None]).ravel()
+    order = np.argsort(steps, kind="stable")
+    step_sizes = np.bincount(steps)
+    step_ends = np.cumsum(step_sizes)
+    positions = positions.ravel()[order]
+    indices = np.empty(rows * cols, dtype=np.intp)
+    colors_buffer = np.empty((step_sizes.max(), dims))
+    # right, down left, down and down right neighbours
+    offsets = np.array([1, width - 1, width, width + 1])
+    weights = np.array([7, 3, 5, 1])[:, None, None] / 16
+    step_start = 0
+    for step_end in step_ends:
+        step_positions = positions[step_start:step_end]
+        colors = np.take(
+            padded, step_positions, axis=0, out=colors_buffer[: step_end - step_start]
+        )
+        np.maximum(colors, low, out=colors)
+        np.minimum(colors, high, out=colors)
+        _, step_indices = kdtree.query(colors, p=distance_metric)
+        indices[order[step_start:step_end]] = step_indices
+        errors = colors - points[step_indices]
+        # add.at, because the right and the down left neighbour of two cells of the
+        # same wavefront can be the same cell
+        np.add.at(
+            padded,
+            (offsets[:, None] + step_positions).ravel(),
+            (weights * errors).reshape(-1, dims),
+        )
+        step_start = step_end
+    return indices.reshape(rows, cols)
@@ -1,18 +1,41 @@
 """Module to provide helper functions for the media2text package."""
 
+import atexit
 import math
 import os
+import shutil
+import tempfile
+import threading
 import time
+import tracemalloc
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 
 import numpy as np
 from PIL import Image
 
-from .constants import RENDER_TEMP_DIR, SYSTEM_FONT_PATH
-from .image_query_font import ImageQueryFont
+from .constants import (
+    IMAGE_CACHE_BYTES,
+    IMAGE_PYRAMID_MIN_SIZE,
+    REDUCING_GAP,
+    RENDER_TEMP_PREFIX,
+    RESIZE_TILE_ROWS,
+    SYSTEM_FONT_PATH,
+    TILED_RESIZE_PIXELS,
+)
+
+if TYPE_CHECKING:
+    from .image_query_font import ImageQueryFont
+
+_render_temp_dir: str | None = None
+_render_temp_lock = threading.Lock()
+# decoded image pyramids by path and modification time, least recently used first
+_image_pyramids: OrderedDict[tuple[str, int], list[Image.Image]] = OrderedDict()
+_image_pyramids_lock = threading.Lock()
 
 
 def estimate_new_size(
-    font: ImageQueryFont,
+    font: "ImageQueryFont",
     image_size: tuple[int, int],
     num_characters: int,
     row_spacing: float,
@@ -36,19 +59,116 @@ def estimate_new_size(
     return new_size
 
 
-def ready_render_temp():
-    """Function to prepare the render_temp directory for use."""
-    if not os.path.isdir(RENDER_TEMP_DIR):
-        os.mkdir(RENDER_TEMP_DIR)
-    for file in os.listdir(RENDER_TEMP_DIR):
-        try:
-            os.remove(os.path.join(RENDER_TEMP_DIR, file))
-        except PermissionError:
-            pass
+def resize_image(image: Image.Image, new_size: tuple[int, int]) -> np.ndarray:
+    """Function to resize an image and convert it to an RGB array.
+
+    JPEG images are downscaled already by the decoder (draft mode), other formats are
+    first shrunk by integer box reduction before the final resampling. Very large images
+    are resized and converted in horizontal bands. Only the resampling (with its reduced
+    intermediate copy) and the RGB conversion are banded, PIL still decodes the whole
+    source image (JPEG at the reduced draft size).
+
+    Args:
+        image (Image.Image): Image to resize (preferably not loaded yet).
+        new_size (tuple[int, int]): Target size of the image (width, height).
+
+    Returns:
+        np.ndarray: Resized RGB image array.
+    """
+    image.draft("RGB", new_size)
+    if image.size[0] * image.size[1] <= TILED_RESIZE_PIXELS:
+        image = image.resize(new_size, reducing_gap=REDUCING_GAP)
+        return np.array(image.convert("RGB"))
+    image_array = np.empty((new_size[1], new_size[0], 3), dtype=np.uint8)
+    row_scale = image.size[1] / new_size[1]
+    for start in range(0, new_size[1], RESIZE_TILE_ROWS):
+        end = min(start + RESIZE_TILE_ROWS, new_size[1])
+        band = image.resize(
+            (new_size[0], end - start),
+            box=(0, start * row_scale, image.size[0], end * row_scale),
+            reducing_gap=REDUCING_GAP,
+        )
+        image_array[start:end] = np.asarray(band.convert("RGB"))
+    return image_array
+
+
+def _pyramid_bytes(pyramid: list[Image.Image]) -> int:
+    return sum(level.size[0] * level.size[1] * 3 for level in pyramid)
+
+
+def get_image_pyramid(path: str) -> list[Image.Image] | None:
+    """Get the decoded image and its downscaled versions (each half the size of the
+    previous one), they are kept in a cache bounded by IMAGE_CACHE_BYTES, so converting
+    the same image again (e.g. with another character count) skips decoding.
+
+    Args:
+        path (str): Path to the image file.
+
+    Returns:
+        list[Image.Image] | None: RGB images from the largest, None if the image is
+        too large to be cached.
+    """
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    with _image_pyramids_lock:
+        if key in _image_pyramids:
+            _image_pyramids.move_to_end(key)
+            return _image_pyramids[key]
+    image = Image.open(path)
+    # the whole pyramid takes at most 4/3 of the largest level
+    if image.size[0] * image.size[1] * 4 > IMAGE_CACHE_BYTES:
+        return None
+    pyramid = [image.convert("RGB")]
+    while min(pyramid[-1].size) >= 2 * IMAGE_PYRAMID_MIN_SIZE:
+        pyramid.append(pyramid[-1].reduce(2))
+    with _image_pyramids_lock:
+        _image_pyramids[key] = pyramid
+        total_bytes = sum(map(_pyramid_bytes, _image_pyramids.values()))
+        while total_bytes > IMAGE_CACHE_BYTES:
+            total_bytes -= _pyramid_bytes(_image_pyramids.popitem(last=False)[1])
+    return pyramid
+
+
+def resize_from_pyramid(
+    pyramid: list[Image.Image], new_size: tuple[int, int]
+) -> np.ndarray:
+    """Function to resize an image using its pyramid, only the smallest level that is
+    still at least as large as the target size is resampled.
+
+    Args:
+        pyramid (list[Image.Image]): Image pyramid created by get image pyramid.
+        new_size (tuple[int, int]): Target size of the image (width, height).
+
+    Returns:
+        np.ndarray: Resized RGB image array.
+    """
+    level = next(
+        (
+            level
+            for level in reversed(pyramid)
+            if level.size[0] >= new_size[0] and level.size[1] >= new_size[1]
+        ),
+        pyramid[0],
+    )
+    return np.array(level.resize(new_size, reducing_gap=REDUCING_GAP))
+
+
+def get_render_temp_dir() -> str:
+    """Get the render temp directory of this process, it is created on first use and
+    removed (with its content) when the process exits.
+
+    Returns:
+        str: Path to the render temp directory.
+    """
+    global _render_temp_dir  # pylint: disable=global-statement
+    with _render_temp_lock:
+        if _render_temp_dir is None:
+            _render_temp_dir = tempfile.mkdtemp(prefix=RENDER_TEMP_PREFIX)
+            atexit.register(shutil.rmtree, _render_temp_dir, ignore_errors=True)
+        return _render_temp_dir
 
 
 def query_benchmark(
-    font: ImageQueryFont, image: Image.Image | str, num_characters: int, repeats: int
+    font: "ImageQueryFont", image: Image.Image | str, num_characters: int, repeats: int
 ) -> float:
     """Function to benchmark the image_convert function.
 
@@ -61,9 +181,10 @@ def query_benchmark(
     Returns:
         float: Average number of images converted in a second.
     """
+    if isinstance(image, str):
+        image = Image.open(image)
     new_size = estimate_new_size(font, image.size, num_characters, 1)
-    image = image.resize(new_size)
-    image_array = np.array(image)
+    image_array = resize_image(image, new_size)
     repeat_count = repeats
     count = 0
     average = 0
@@ -79,6 +200,64 @@ def query_benchmark(
     return average / repeats
 
 
+def query_memory_benchmark(
+    font: "ImageQueryFont",
+    image: Image.Image | str,
+    num_characters: int,
+    num_frames: int = 1,
+    distance_metric: str = "manhattan",
+) -> dict:
+    """Function to measure the memory allocated by a query, frames are queried as a
+    batch the way videos are converted.
+
+    Args:
+        font (ImageQueryFont): Font to use for conversion.
+        image (Image): Image to convert.
+        num_characters (int): Approximate number of characters to use in the output.
+        num_frames (int, optional): Number of copies of the image queried as a batch.
+        Defaults to 1.
+        distance_metric (str, optional): Distance metric to be used for query.
+        Defaults to "manhattan".
+
+    Returns:
+        dict: Peak number of bytes allocated during the query per pixel of the
+        resized image (peak_bytes_per_pixel) and per frame (peak_bytes_per_frame),
+        and the number of memory blocks and bytes still allocated once the result is
+        deleted (retained_blocks, retained_bytes, i.e. what the font keeps). Python
+        has no cumulative count of allocations, tracemalloc only sees blocks that are
+        alive, so temporaries freed during the query only show in the peak.
+    """
+    if isinstance(image, str):
+        image = Image.open(image)
+    new_size = estimate_new_size(font, image.size, num_characters, 1)
+    frames = np.repeat(resize_image(image, new_size)[None], num_frames, axis=0)
+    # the first query builds the lazily created kd-trees
+    font.query_batch(frames, distance_metric)
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    start, _ = tracemalloc.get_traced_memory()
+    texts = font.query_batch(frames, distance_metric)
+    _, peak = tracemalloc.get_traced_memory()
+    del texts
+    after = tracemalloc.take_snapshot()
+    if not was_tracing:
+        tracemalloc.stop()
+    # blocks of the snapshots themselves are not counted
+    not_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    statistics = after.filter_traces(not_tracemalloc).compare_to(
+        before.filter_traces(not_tracemalloc), "filename"
+    )
+    return {
+        "peak_bytes_per_pixel": (peak - start) / frames[..., 0].size,
+        "peak_bytes_per_frame": (peak - start) / num_frames,
+        "retained_blocks": sum(stat.count_diff for stat in statistics),
+        "retained_bytes": sum(stat.size_diff for stat in statistics),
+    }
+
+
 def get_system_fonts_paths() -> list[str]:
     """Get a list of system font path.
 
@@ -1,10 +1,16 @@
 """Module for converting an image to text using a font."""
 
-import numpy as np
+from typing import BinaryIO
+
 from PIL import Image
 
 from .constants import BYTE_ORDER, INT_SIZE, TEXT_IMAGE_MAGIC_NUMBER
-from .helpers import estimate_new_size
+from .helpers import (
+    estimate_new_size,
+    get_image_pyramid,
+    resize_from_pyramid,
+    resize_image,
+)
 from .image_query_font import ImageQueryFont
 
 
@@ -18,6 +24,9 @@ class TextImage:
         num_characters: int,
         row_spacing: float = 1.0,
         distance_metric: str = "manhattan",
+        color_mode: str | None = None,
+        dither: str | None = None,
+        cache: bool = False,
     ):
         """Function to convert an image to text using a font.
 
@@ -28,30 +37,114 @@ class TextImage:
             row_spacing (float, optional): Spacing between rows. Defaults to 1.1.
             distance_metric (str, optional): Distance metric to be used for query.
             Defaults to "manhattan".
+            color_mode (str | None, optional): ANSI color mode of the output, either
+            "truecolor", "256" or None for plain text. Defaults to None.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" or "ordered". Defaults to None.
+            cache (bool, optional): Whether to keep the decoded image (and its
+            pyramid) of a path in a cache, so converting it again with other
+            parameters only resamples and queries. Single conversions decode a
+            downscaled JPEG instead (see resize image), the same as stream does.
+            Defaults to False.
 
         Returns:
             str: String representation of the image.
         """
+        pyramid = None
         if isinstance(image, str):
             with open(image, "rb") as file:
                 magic_number = int.from_bytes(file.read(INT_SIZE), BYTE_ORDER)
                 if magic_number == TEXT_IMAGE_MAGIC_NUMBER:
                     self.text = file.read().decode("utf-8")
                     return
-            image = Image.open(image)
+            if cache:
+                # converting again only resamples and queries
+                pyramid = get_image_pyramid(image)
+            image = Image.open(image) if pyramid is None else pyramid[0]
+        self.distance_metric = distance_metric
+        self.color_mode = color_mode
+        self.dither = dither
         new_size = estimate_new_size(font, image.size, num_characters, row_spacing)
-        image = image.resize(new_size)
-        image = image.convert("RGB")
-        self.image_array = np.array(image)
-        self.text = font.query(self.image_array, distance_metric)
+        if pyramid is None:
+            self.image_array = resize_image(image, new_size)
+        else:
+            self.image_array = resize_from_pyramid(pyramid, new_size)
+        self.text = font.query(self.image_array, distance_metric, color_mode, dither)
+
+    @staticmethod
+    def stream(
+        font: ImageQueryFont,
+        image: Image.Image | str,
+        output: BinaryIO | str,
+        num_characters: int,
+        row_spacing: float = 1.0,
+        distance_metric: str = "manhattan",
+        header: bool = True,
+        color_mode: str | None = None,
+        dither: str | None = None,
+    ):
+        """Function to convert an image to text, writing it row by row to the output
+        without ever building the whole text in memory.
+
+        Args:
+            font (ImageQueryFont): Font to use for conversion.
+            image (Image.Image | str): Image to convert (image or a path to an image file).
+            output (BinaryIO | str): Binary stream or a path of the file to write to.
+            num_characters (int): Approximate number of characters to use in the output.
+            row_spacing (float, optional): Spacing between rows. Defaults to 1.0.
+            distance_metric (str, optional): Distance metric to be used for query.
+            Defaults to "manhattan".
+            header (bool, optional): Whether to write the text image magic number first,
+            making the output a valid saved text image. Defaults to True.
+            color_mode (str | None, optional): ANSI color mode of the output, either
+            "truecolor", "256" or None for plain text. Defaults to None.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" or "ordered" (error diffusion does not cross the
+            query tiles). Defaults to None.
+        """
+        rendered_text = None
+        if isinstance(image, str):
+            with open(image, "rb") as file:
+                magic_number = int.from_bytes(file.read(INT_SIZE), BYTE_ORDER)
+                rendered_text = (
+                    file.read() if magic_number == TEXT_IMAGE_MAGIC_NUMBER else None
+                )
+            if rendered_text is None:
+                image = Image.open(image)
+        if rendered_text is None:
+            new_size = estimate_new_size(font, image.size, num_characters, row_spacing)
+            image_array = resize_image(image, new_size)
+        file = open(output, "wb") if isinstance(output, str) else output
+        try:
+            if header:
+                file.write(TEXT_IMAGE_MAGIC_NUMBER.to_bytes(INT_SIZE, BYTE_ORDER))
+            if rendered_text is not None:
+                file.write(rendered_text)
+                return
+            rows = font.iter_query(
+                image_array, distance_metric, color_mode=color_mode, dither=dither
+            )
+            for i, row in enumerate(rows):
+                file.write((row if i == 0 else "\n" + row).encode("utf-8"))
+        finally:
+            if isinstance(output, str):
+                file.close()
+            else:
+                file.flush()
 
-    def change_font(self, font: ImageQueryFont):
-        """Change the font of the text image.
+    def change_font(self, font: ImageQueryFont, distance_metric: str | None = None):
+        """Change the font (and optionally distance metric) of the text image.
 
         Args:
             font (ImageQueryFont): New font to use.
+            distance_metric (str | None, optional): New distance metric to use.
+            Defaults to None (keep the current one).
         """
-        self.text = font.query(self.image_array)
+        if distance_metric is not None:
+            self.distance_metric = distance_metric
+        self.text = font.query(
+            self.image_array, self.distance_metric, self.color_mode, self.dither
+        )
 
     def save(self, path: str):
         """Function to save an image to a file.
@@ -1,14 +1,41 @@
 """Module for font allowing for color to character queries"""
 
+import hashlib
+import json
 import sys
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
 import numpy as np
 from fontTools.ttLib import TTFont
 from PIL import Image, ImageDraw, ImageFont, features
 from scipy.spatial import KDTree, cKDTree
 
-from .constants import BLACK, LOOKUP_TYPE_LIGATURE, SYSTEM_FONT_PATH, WHITE
+from .ansi import check_color_mode, colorize_row, quantize_colors
+from .color_spaces import to_color_space
+from .dithering import check_dither_mode, diffuse_errors, ordered_dither
+from .pruning import (
+    check_prune_priority,
+    measure_query_speedup,
+    merge_within_tolerance,
+    priority_order,
+    spread_sample,
+)
+from .scheduler import get_scheduler, start_thread
+from .constants import (
+    BLACK,
+    LOOKUP_TYPE_LIGATURE,
+    PROGRESSIVE_BATCH_SIZE,
+    PROGRESSIVE_SUBSET_SIZE,
+    QUERY_CHUNK_SIZE,
+    QUERY_THREAD_POINTS,
+    QUERY_TILE_ROWS,
+    SHAPE_COMPONENTS,
+    SYSTEM_FONT_PATH,
+    WHITE,
+)
 
 
 class ImageQueryFont:
@@ -25,7 +52,23 @@ class ImageQueryFont:
         use_ligatures: bool = True,
         force_monospace: bool = False,
         font_render_size: int = 100,
+        shape_grid: int = 1,
+        shape_components: int = SHAPE_COMPONENTS,
+        prune_tolerance: float = 0.0,
+        max_glyphs: int | None = None,
+        prune_priority: str = "narrowest",
+        progressive: bool = False,
+        progress_callback: Callable[[int, int], None] | None = None,
     ):
+        if shape_grid < 1:
+            raise ValueError("Shape grid size must be at least 1.")
+        if max_glyphs is not None and max_glyphs < 2:
+            raise ValueError("Maximum number of glyphs must be at least 2.")
+        check_prune_priority(prune_priority)
+        self.prune_tolerance = prune_tolerance
+        self.max_glyphs = max_glyphs
+        self.prune_priority = prune_priority
+        self.shape_grid = shape_grid
         self.font_path = self._get_font_path(font_path)
         font = TTFont(self.font_path)
         self.ppem_ratio = font_render_size / font["head"].unitsPerEm
@@ -50,12 +93,18 @@ class ImageQueryFont:
             )
             cmap = ligature_dict | cmap
             rev_cmap = rev_ligature_dict | rev_cmap
-        draw_font = ImageFont.truetype(
+        self.draw_font = ImageFont.truetype(
             self.font_path,
             font_render_size,
             encoding="unic",
             layout_engine=layout_engine,
         )
+        # FreeType faces are not thread safe and the background loading renders
+        # glyphs while other threads may too, so glyphs are rendered one at a time
+        self._render_lock = threading.Lock()
+        self.text_color = text_color
+        self.bg_color = bg_color
+        self.use_embedded_color = use_embedded_color
         self.max_char_width = max(
             font["hmtx"].metrics[glyph][0] for glyph in cmap.values()
         )
@@ -65,21 +114,40 @@ class ImageQueryFont:
         self.is_monospace = (
             True if force_monospace else self._is_monospace(cmap, rev_cmap)
         )
-        averages_dict = self._create_averages_dict(
-            draw_font, text_color, bg_color, use_embedded_color, cmap, rev_cmap
-        )
-        # recalculate char_widths after removing characters with width 0
-        self.char_widths = {
-            char: font["hmtx"].metrics[glyph][0] for char, glyph in cmap.items()
-        }
-        self.max_char_width = max(width for width in self.char_widths.values())
-        self.average_char_width = sum(list(self.char_widths.values())) / len(
-            self.char_widths
-        )
-        self.kdtree, self.index_char_dict = self._create_kdtree_and_index_char_dict(
-            averages_dict
+        if shape_grid > 1 and not self.is_monospace:
+            raise ValueError(
+                "Shape matching requires a monospace font (try forcing monospace)."
+            )
+        self.shape_components = shape_components
+        self.progress_callback = progress_callback
+        # queries read the index while the background build (or recolor) swaps it
+        self._index_condition = threading.Condition()
+        self._index_readers = 0
+        self._index_swapping = False
+        self._stop_loading = threading.Event()
+        self._loading_thread = None
+        self.loading_error = None
+        chars = list(cmap)
+        self.num_glyphs = len(chars)
+        self.is_complete = not progressive or len(chars) <= PROGRESSIVE_SUBSET_SIZE
+        # a progressive font is usable after rendering a subset, the rest of the glyphs
+        # is rendered in the background and swapped in when all are done
+        subset = chars if self.is_complete else self._progressive_subset(chars)
+        self.coverage_dict, self.embedded_color_chars = self._create_coverage_dict(
+            cmap, rev_cmap, subset
         )
-        self.num_characters = len(self.index_char_dict)
+        # recalculate char_widths after removing characters with width 0, a progressive
+        # font keeps the widths of all characters until all glyphs are rendered
+        self._update_char_widths(cmap if self.is_complete else chars)
+        self._build_index()
+        if not self.is_complete:
+            subset_set = set(subset)
+            self._loading_thread = start_thread(
+                self._complete_index,
+                cmap,
+                rev_cmap,
+                [char for char in chars if char not in subset_set],
+            )
 
     def _get_font_path(self, font_path: str) -> str:
         if Path(font_path).is_file():
@@ -162,95 +230,373 @@ class ImageQueryFont:
         rev_ligature_dict = {value: key for key, value in ligature_dict.items()}
         return ligature_dict, rev_ligature_dict
 
-    def _create_averages_dict(
-        self,
-        draw_font: ImageFont.FreeTypeFont,
-        text_color: tuple[int, int, int],
-        bg_color: tuple[int, int, int],
-        use_embedded_color: bool,
-        cmap: dict[str, str],
-        rev_cmap: dict[str, str],
-    ) -> dict[str, np.ndarray]:
-        glyph_height = self.units_to_pixels(self.char_height)
-        glyph_width = self.units_to_pixels(self.max_char_width)
-        averages_dict = {}
-        for char, glyph in list(cmap.items()):
-            if not self.is_monospace:
-                glyph_width = self.units_to_pixels(self.char_widths[char])
-            if glyph_width == 0:
+    def _create_coverage_dict(
+        self, cmap: dict[str, str], rev_cmap: dict[str, str], chars: list[str]
+    ) -> tuple[dict[str, np.ndarray], set[str]]:
+        # rendering white on black gives the fraction of each pixel covered by glyph,
+        # average color in any colors is then just a blend weighted by the coverage
+        coverage_dict = {}
+        embedded_color_chars = set()
+        for char in chars:
+            glyph = cmap[char]
+            if self.get_glyph_width(char) == 0:
                 cmap.pop(char)
                 rev_cmap.pop(glyph)
                 continue
-            image = Image.new("RGB", (glyph_width, glyph_height), bg_color)
-            draw = ImageDraw.Draw(image)
-            draw.text(
-                (0, 0), char, text_color, draw_font, embedded_color=use_embedded_color
-            )
-            colors_average = np.average(np.array(image), axis=(0, 1))
-            if (colors_average == bg_color).all() and not char.isspace():
+            image = self.render_glyph(char, WHITE, BLACK)
+            if self.use_embedded_color and (image != image[..., :1]).any():
+                # glyphs with embedded colors (emoji) have to be rendered in each colors
+                embedded_color_chars.add(char)
+                colors_average = self._glyph_descriptor(self.render_glyph(char))
+                is_empty = (colors_average.reshape(-1, 3) == self.bg_color).all()
+            else:
+                colors_average = self._glyph_descriptor(image) / 255
+                is_empty = not colors_average.any()
+            if is_empty and not char.isspace():
+                embedded_color_chars.discard(char)
                 cmap.pop(char)
                 rev_cmap.pop(glyph)
                 continue
-            averages_dict[char] = colors_average
-        min_color = np.min(list(averages_dict.values()), axis=0)
-        max_color = np.max(list(averages_dict.values()), axis=0)
+            coverage_dict[char] = colors_average
+        return coverage_dict, embedded_color_chars
+
+    def _update_char_widths(self, chars: Iterable[str]):
+        self.char_widths = {char: self.char_widths[char] for char in chars}
+        self.max_char_width = max(width for width in self.char_widths.values())
+        self.average_char_width = sum(list(self.char_widths.values())) / len(
+            self.char_widths
+        )
+
+    def _progressive_subset(self, chars: list[str]) -> list[str]:
+        # colors of the glyphs are not known before rendering them, so apart from
+        # ASCII the subset is spread evenly over the other characters in codepoint
+        # order (i.e. over all blocks of the font)
+        subset = [char for char in chars if char.isascii()][:PROGRESSIVE_SUBSET_SIZE]
+        others = sorted(char for char in chars if not char.isascii())
+        count = min(PROGRESSIVE_SUBSET_SIZE - len(subset), len(others))
+        if count > 0:
+            positions = np.linspace(0, len(others) - 1, count).round().astype(int)
+            subset += [others[i] for i in np.unique(positions)]
+        return subset
+
+    def _complete_index(
+        self, cmap: dict[str, str], rev_cmap: dict[str, str], chars: list[str]
+    ):
+        coverage_dict = dict(self.coverage_dict)
+        embedded_color_chars = set(self.embedded_color_chars)
+        num_done = self.num_glyphs - len(chars)
+        try:
+            for start in range(0, len(chars), PROGRESSIVE_BATCH_SIZE):
+                if self._stop_loading.is_set():
+                    return
+                batch = chars[start : start + PROGRESSIVE_BATCH_SIZE]
+                # the glyphs are rendered with the priority of the code that created
+                # the font, sharing the CPU with playback between batches
+                with get_scheduler().reserve(1):
+                    batch_coverage, batch_embedded = self._create_coverage_dict(
+                        cmap, rev_cmap, batch
+                    )
+                coverage_dict |= batch_coverage
+                embedded_color_chars |= batch_embedded
+                num_done += len(batch)
+                if (
+                    self.progress_callback is not None
+                    and num_done < self.num_glyphs
+                    and not self._stop_loading.is_set()
+                ):
+                    self.progress_callback(num_done, self.num_glyphs)
+            with self._swapping_index():
+                # same order of the glyphs as if all were rendered at once
+                self.coverage_dict = {char: coverage_dict[char] for char in cmap}
+                self.embedded_color_chars = embedded_color_chars
+                self._update_char_widths(cmap)
+                self._build_index()
+                self.is_complete = True
+        except Exception as e:  # pylint: disable=broad-except
+            self.loading_error = str(e)
+            print(
+                f"Warning: Loading all glyphs failed, only a subset is used ({e}).",
+                file=sys.stderr,
+            )
+            return
+        if self.progress_callback is not None and not self._stop_loading.is_set():
+            self.progress_callback(self.num_glyphs, self.num_glyphs)
+
+    @contextmanager
+    def _reading_index(self) -> Iterator[None]:
+        with self._index_condition:
+            self._index_condition.wait_for(lambda: not self._index_swapping)
+            self._index_readers += 1
+        try:
+            yield
+        finally:
+            with self._index_condition:
+                self._index_readers -= 1
+                self._index_condition.notify_all()
+
+    @contextmanager
+    def _swapping_index(self) -> Iterator[None]:
+        # new readers wait for the swap, the swap waits for the current readers
+        with self._index_condition:
+            self._index_condition.wait_for(lambda: not self._index_swapping)
+            self._index_swapping = True
+            self._index_condition.wait_for(lambda: self._index_readers == 0)
+        try:
+            yield
+        finally:
+            with self._index_condition:
+                self._index_swapping = False
+                self._index_condition.notify_all()
+
+    def _build_index(self):
+        self.kdtree, self.index_char_dict = self._create_kdtree_and_index_char_dict(
+            self._prune_averages_dict(self._create_averages_dict()),
+            self.shape_components,
+        )
+        self.num_characters = len(self.index_char_dict)
+
+    def _create_averages_dict(self) -> dict[str, np.ndarray]:
+        num_cells = self.shape_grid**2
+        text_color = np.tile(np.array(self.text_color, dtype=np.float64), num_cells)
+        bg_color = np.tile(np.array(self.bg_color, dtype=np.float64), num_cells)
+        coverages = np.array(list(self.coverage_dict.values()))
+        # (glyphs, sub-cells, channels), a single sub-cell unless in shape mode
+        averages = (bg_color + coverages * (text_color - bg_color)).reshape(
+            len(coverages), -1, 3
+        )
+        for i, char in enumerate(self.coverage_dict):
+            if char in self.embedded_color_chars:
+                averages[i] = self._glyph_descriptor(self.render_glyph(char)).reshape(
+                    -1, 3
+                )
+        min_color = np.min(averages, axis=(0, 1))
+        max_color = np.max(averages, axis=(0, 1))
         if (max_color == min_color).any():
-            min_color += 0.00001 # to prevent zero division
+            min_color += 0.00001  # to prevent zero division
         # normalizing the colors to 0-255 range
-        for char, average in averages_dict.items():
-            averages_dict[char] = (average - min_color) / (max_color - min_color) * 255
-        return averages_dict
+        averages = (averages - min_color) / (max_color - min_color) * 255
+        return dict(zip(self.coverage_dict, averages.reshape(len(averages), -1)))
 
-    def _create_kdtree_and_index_char_dict(
+    def _prune_averages_dict(
         self, averages_dict: dict[str, np.ndarray]
+    ) -> dict[str, np.ndarray]:
+        # glyphs of similar colors (and shapes) only make the kd-tree larger, they are
+        # merged within the tolerance and/or reduced to the best spread ones
+        self.pruning_stats = None
+        if self.prune_tolerance <= 0 and self.max_glyphs is None:
+            return averages_dict
+        chars = list(averages_dict)
+        # distances of shape descriptors are scaled to the distance of one sub-cell
+        descriptors = np.array(list(averages_dict.values())) / self.shape_grid
+        kept = priority_order(chars, self.char_widths, self.prune_priority)
+        if self.prune_tolerance > 0:
+            kept = merge_within_tolerance(descriptors, kept, self.prune_tolerance)
+        num_merged = len(chars) - len(kept)
+        if self.max_glyphs is not None and len(kept) > self.max_glyphs:
+            kept = spread_sample(descriptors, kept, self.max_glyphs)
+        kept.sort()
+        self.pruning_stats = {
+            "glyphs": len(chars),
+            "merged": num_merged,
+            "capped": len(chars) - num_merged - len(kept),
+            "kept": len(kept),
+            "query_speedup": measure_query_speedup(descriptors, descriptors[kept]),
+        }
+        return {chars[i]: averages_dict[chars[i]] for i in kept}
+
+    def _glyph_descriptor(self, glyph: np.ndarray) -> np.ndarray:
+        if self.shape_grid == 1:
+            return np.average(glyph, axis=(0, 1))
+        # average color of each cell of a shape_grid x shape_grid grid (row-major)
+        bands = np.array_split(glyph, self.shape_grid, axis=0)
+        cells = [np.array_split(band, self.shape_grid, axis=1) for band in bands]
+        return np.array(
+            [[cell.mean(axis=(0, 1)) for cell in row] for row in cells]
+        ).reshape(-1)
+
+    def _create_shape_basis(self, descriptors: np.ndarray, num_components: int):
+        # PCA of the glyph descriptors, queries are done in the reduced space
+        self.shape_mean = descriptors.mean(axis=0)
+        _, _, components = np.linalg.svd(
+            descriptors - self.shape_mean, full_matrices=False
+        )
+        self.shape_basis = components[:num_components]
+
+    def _extract_shape_features(self, image: np.ndarray) -> np.ndarray:
+        grid = self.shape_grid
+        rows, cols = image.shape[0] // grid, image.shape[1] // grid
+        cells = image[: rows * grid, : cols * grid].reshape(rows, grid, cols, grid, 3)
+        features = cells.transpose(0, 2, 1, 3, 4).reshape(rows * cols, -1)
+        return (features - self.shape_mean) @ self.shape_basis.T
+
+    def _create_kdtree_and_index_char_dict(
+        self, averages_dict: dict[str, np.ndarray], shape_components: int
     ) -> tuple[cKDTree, dict[int, str]]:
-        averages_array = np.empty((len(averages_dict) + 1, 3))
-        index_char_dict = {}
-        for i, (char, average) in enumerate(averages_dict.items()):
-            averages_array[i] = average
-            index_char_dict[i] = char
-        # dummy value for out of bounds queries
-        averages_array[len(averages_dict)] = (-255, -255, -255)
+        averages_array = np.array(list(averages_dict.values()))
+        index_char_dict = dict(enumerate(averages_dict))
+        # kd-trees of the averages in perceptual color spaces, created on first use
+        self.averages_array = averages_array
+        self.color_space_kdtrees = {}
+        # ordered dithering amplitude, the typical brightness step between glyphs
+        brightness = np.unique(averages_array.mean(axis=1).round(3))
+        self.dither_spread = (
+            np.percentile(np.diff(brightness), 90) if len(brightness) > 1 else 0.0
+        )
+        if self.shape_grid > 1:
+            self._create_shape_basis(averages_array, shape_components)
+            averages_array = (averages_array - self.shape_mean) @ self.shape_basis.T
+        # dummy value for out of bounds queries (far away from all glyph descriptors)
+        dummy_value = -255 if self.shape_grid == 1 else -255 * 3 * self.shape_grid**2
+        averages_array = np.vstack(
+            (averages_array, np.full(averages_array.shape[1], dummy_value))
+        )
         index_char_dict[len(averages_dict)] = ""
         kdtree = KDTree(averages_array)
         return kdtree, index_char_dict
 
-    def _calculate_offset_colors(
-        self, image: np.ndarray, start_offsets: np.ndarray
-    ) -> np.ndarray:
-        line_width = image.shape[1] * self.char_height
-        offset_colors = np.empty((image.shape[0], 3))
-        for i, row in enumerate(image):
-            if start_offsets[i] >= line_width:
-                offset_colors[i] = (-255, -255, -255)
-                continue
-            offset_colors[i] = row[start_offsets[i] // self.char_height]
-        return offset_colors
-
-    def _query_monospace(self, image: np.ndarray, distance_metric: int) -> str:
-        cols = image.shape[1]
-        image = image.reshape(-1, 3)
-        _, indices = self.kdtree.query(image, p=distance_metric, workers=-1)
-        indices = indices.reshape(-1, cols)
+    def _get_kdtree(self, color_space: str | None) -> KDTree:
+        if color_space is None:
+            return self.kdtree
+        if color_space not in self.color_space_kdtrees:
+            averages_array = to_color_space(self.averages_array, color_space)
+            # same dummy value as in RGB, still far away from all converted colors
+            self.color_space_kdtrees[color_space] = KDTree(
+                np.vstack((averages_array, np.full(3, -255)))
+            )
+        return self.color_space_kdtrees[color_space]
+
+    def _cell_colors(self, image: np.ndarray) -> np.ndarray:
+        if self.shape_grid == 1:
+            return image
+        grid = self.shape_grid
+        rows, cols = image.shape[0] // grid, image.shape[1] // grid
+        cells = image[: rows * grid, : cols * grid].reshape(rows, grid, cols, grid, 3)
+        return cells.mean(axis=(1, 3))
+
+    def _query_monospace(
+        self,
+        image: np.ndarray,
+        query_image: np.ndarray,
+        kdtree: KDTree,
+        distance_metric: int,
+        color_mode: str | None = None,
+        dither: str | None = None,
+        frame_rows: int | None = None,
+        workers: int = 1,
+    ) -> list[str]:
+        if self.shape_grid > 1:
+            cols = image.shape[1] // self.shape_grid
+            features = self._extract_shape_features(query_image)
+        else:
+            cols = image.shape[1]
+            features = query_image.reshape(-1, 3)
+        if dither == "floyd-steinberg":
+            indices = diffuse_errors(
+                features.reshape(-1, cols, features.shape[1]),
+                kdtree,
+                distance_metric,
+                frame_rows,
+            )
+        else:
+            # the kd-tree converts the points to float64 and returns float64
+            # distances, so points are queried in chunks to bound those copies
+            indices = np.empty(len(features), dtype=np.intp)
+            for start in range(0, len(features), QUERY_CHUNK_SIZE):
+                _, indices[start : start + QUERY_CHUNK_SIZE] = kdtree.query(
+                    features[start : start + QUERY_CHUNK_SIZE],
+                    p=distance_metric,
+                    workers=workers,
+                )
+            indices = indices.reshape(-1, cols)
+        if color_mode is not None:
+            codes = quantize_colors(self._cell_colors(image), color_mode)
+            return [
+                colorize_row(
+                    [self.index_char_dict[i] for i in row],
+                    row_codes,
+                    color_mode,
+                    "\u200a",
+                )
+                for row, row_codes in zip(indices, codes)
+            ]
         # using \u200a to prevent accidental ligatures
-        return "\n".join(
-            "\u200a".join(self.index_char_dict[i] for i in row) for row in indices
-        )
+        return ["\u200a".join(self.index_char_dict[i] for i in row) for row in indices]
 
-    def _query_non_monospace(self, image: np.ndarray, distance_metric: int) -> str:
-        col_offsets = np.zeros(image.shape[0], dtype=np.int32)
-        finished = False
-        result = ["" for _ in range(image.shape[0])]
-        while not finished:
-            finished = True
-            averages = self._calculate_offset_colors(image, col_offsets)
-            _, indices = self.kdtree.query(averages, p=distance_metric)
-            for i, result_index in enumerate(indices):
+    def _query_non_monospace(
+        self,
+        image: np.ndarray,
+        query_image: np.ndarray,
+        kdtree: KDTree,
+        distance_metric: int,
+        color_mode: str | None = None,
+        dither: str | None = None,
+    ) -> list[str]:
+        num_rows, width = image.shape[:2]
+        line_width = width * self.char_height
+        dummy_index = len(self.index_char_dict) - 1
+        col_offsets = np.zeros(num_rows, dtype=np.int32)
+        # cells of neighbouring rows do not line up, so with error diffusion the error
+        # is only carried to the next character of the same row
+        errors = np.zeros((num_rows, 3))
+        points = kdtree.data
+        low, high = points[:-1].min(axis=0), points[:-1].max(axis=0)
+        flat_query_image = query_image.reshape(-1, 3)
+        flat_image = image.reshape(-1, 3)
+        # buffers reused by every step (colors keep the dtype of the image, the only
+        # conversion to float is the one done by the kd-tree query)
+        colors_buffer = np.empty((num_rows, 3), dtype=query_image.dtype)
+        source_colors_buffer = np.empty((num_rows, 3), dtype=image.dtype)
+        indices_buffer = np.empty(num_rows, dtype=np.intp)
+        codes_buffer = np.empty(num_rows, dtype=np.int64)
+        # rows that have not reached the rightmost side of the image yet
+        active_rows = np.arange(num_rows)
+        result = ["" for _ in range(num_rows)]
+        # matched characters and their color codes, only used with color_mode
+        result_chars = [[] for _ in range(num_rows)]
+        result_codes = [[] for _ in range(num_rows)]
+        while len(active_rows) > 0:
+            offsets = col_offsets[active_rows]
+            # rows past the rightmost side are not queried, they get the dummy
+            in_bounds = offsets < line_width
+            query_rows = active_rows[in_bounds]
+            pixel_indices = query_rows * width + offsets[in_bounds] // self.char_height
+            colors = np.take(
+                flat_query_image,
+                pixel_indices,
+                axis=0,
+                out=colors_buffer[: len(query_rows)],
+                mode="clip",
+            )
+            if dither == "floyd-steinberg":
+                colors = np.clip(colors + errors[query_rows], low, high)
+            indices = indices_buffer[: len(active_rows)]
+            indices.fill(dummy_index)
+            if len(query_rows) > 0:
+                indices[in_bounds] = kdtree.query(colors, p=distance_metric)[1]
+            if dither == "floyd-steinberg":
+                errors[query_rows] = colors - points[indices[in_bounds]]
+            if color_mode is not None:
+                source_colors = colors
+                if query_image is not image or dither == "floyd-steinberg":
+                    source_colors = np.take(
+                        flat_image,
+                        pixel_indices,
+                        axis=0,
+                        out=source_colors_buffer[: len(query_rows)],
+                        mode="clip",
+                    )
+                codes = codes_buffer[: len(active_rows)]
+                codes[in_bounds] = quantize_colors(source_colors, color_mode)
+            still_active_rows = []
+            for j, (i, result_index) in enumerate(zip(active_rows, indices)):
                 result_char = self.index_char_dict[result_index]
                 # using \u200a to prevent accidental ligatures
                 result[i] += result_char + "\u200a"
                 if result_index != len(self.index_char_dict) - 1:
-                    finished = False
+                    still_active_rows.append(i)
+                    if color_mode is not None:
+                        result_chars[i].append(result_char)
+                        result_codes[i].append(codes[j])
                     char_width = self.char_widths[result_char]
                     if (
                         self.kerning
@@ -259,7 +605,85 @@ class ImageQueryFont:
                     ):
                         char_width += self.kerning[result[i][-2:]]
                     col_offsets[i] += char_width
-        return "\n".join(result)
+            active_rows = np.array(still_active_rows, dtype=np.intp)
+        if color_mode is not None:
+            return [
+                colorize_row(chars, codes, color_mode, "\u200a")
+                for chars, codes in zip(result_chars, result_codes)
+            ]
+        return result
+
+    def _get_metric(self, distance_metric: str) -> tuple[int, str | None]:
+        # minkowski p and color space (perceptual metrics are euclidean, i.e. delta E)
+        distance_metrics = {
+            "manhattan": (1, None),
+            "euclidean": (2, None),
+            "cielab": (2, "cielab"),
+            "oklab": (2, "oklab"),
+        }
+        if distance_metric not in distance_metrics:
+            raise ValueError(
+                f"Invalid distance metric, use one of: {' '.join(distance_metrics.keys())}"
+            )
+        if distance_metrics[distance_metric][1] is not None and self.shape_grid > 1:
+            raise ValueError(
+                "Perceptual distance metrics do not support shape matching."
+            )
+        return distance_metrics[distance_metric]
+
+    def _query_rows(
+        self,
+        image: np.ndarray,
+        metric: tuple[int, str | None],
+        color_mode: str | None = None,
+        dither: str | None = None,
+        frame_rows: int | None = None,
+    ) -> list[str]:
+        with self._reading_index():
+            return self._query_rows_unlocked(
+                image, metric, color_mode, dither, frame_rows
+            )
+
+    def _query_rows_unlocked(
+        self,
+        image: np.ndarray,
+        metric: tuple[int, str | None],
+        color_mode: str | None = None,
+        dither: str | None = None,
+        frame_rows: int | None = None,
+    ) -> list[str]:
+        distance_metric, color_space = metric
+        kdtree = self._get_kdtree(color_space)
+        # only the monospace query without error diffusion runs on multiple threads,
+        # small images (video frames) don't pay for starting threads at all
+        threads = 1
+        if self.is_monospace and dither != "floyd-steinberg":
+            num_points = image.shape[0] * image.shape[1] // self.shape_grid**2
+            threads = max(1, num_points // QUERY_THREAD_POINTS)
+        with get_scheduler().reserve(threads) as workers:
+            query_image = image
+            if dither == "ordered":
+                query_image = ordered_dither(
+                    image, self.dither_spread, self.shape_grid, frame_rows
+                )
+            if color_space is not None:
+                # the whole image is converted at once (table lookup and matrix
+                # products)
+                query_image = to_color_space(query_image, color_space)
+            if self.is_monospace:
+                return self._query_monospace(
+                    image,
+                    query_image,
+                    kdtree,
+                    distance_metric,
+                    color_mode,
+                    dither,
+                    frame_rows,
+                    workers,
+                )
+            return self._query_non_monospace(
+                image, query_image, kdtree, distance_metric, color_mode, dither
+            )
 
     def units_to_pixels(self, units: int) -> int:
         """Returns the number of pixels that correspond to the given number of font units.
@@ -272,6 +696,117 @@ class ImageQueryFont:
         """
         return round(units * self.ppem_ratio)
 
+    def get_glyph_width(self, char: str) -> int:
+        """Returns the width in pixels of the cell the character is rendered in.
+
+        Args:
+            char (str): Character (or ligature).
+
+        Returns:
+            int: Width of the character cell in pixels.
+        """
+        if self.is_monospace:
+            return self.units_to_pixels(self.max_char_width)
+        return self.units_to_pixels(self.char_widths[char])
+
+    def render_glyph(
+        self,
+        char: str,
+        text_color: tuple[int, int, int] | None = None,
+        bg_color: tuple[int, int, int] | None = None,
+    ) -> np.ndarray:
+        """Renders the character the same way it is rendered for matching, that is in
+        text color on background color into a cell of its width and the font height.
+
+        Args:
+            char (str): Character (or ligature) to render.
+            text_color (tuple[int, int, int] | None, optional): Text color to use
+            instead of the font's one. Defaults to None.
+            bg_color (tuple[int, int, int] | None, optional): Background color to use
+            instead of the font's one. Defaults to None.
+
+        Returns:
+            np.ndarray: RGB image of the character cell.
+        """
+        glyph_height = self.units_to_pixels(self.char_height)
+        image = Image.new(
+            "RGB",
+            (self.get_glyph_width(char), glyph_height),
+            self.bg_color if bg_color is None else bg_color,
+        )
+        draw = ImageDraw.Draw(image)
+        with self._render_lock:
+            draw.text(
+                (0, 0),
+                char,
+                self.text_color if text_color is None else text_color,
+                self.draw_font,
+                embedded_color=self.use_embedded_color,
+            )
+        return np.array(image)
+
+    def recolor(self, text_color: tuple[int, int, int], bg_color: tuple[int, int, int]):
+        """Changes text and background color of the font. Only glyphs with embedded
+        colors are rendered again, average colors of the others are derived from their
+        coverage, so this is much faster than creating the font again.
+
+        Args:
+            text_color (tuple[int, int, int]): New text color.
+            bg_color (tuple[int, int, int]): New background color.
+        """
+        with self._swapping_index():
+            self.text_color = text_color
+            self.bg_color = bg_color
+            self._build_index()
+
+    def wait_until_complete(self, timeout: float | None = None) -> bool:
+        """Waits until all glyphs of a progressive font are loaded.
+
+        Args:
+            timeout (float | None, optional): Maximum time to wait in seconds.
+            Defaults to None (wait as long as it takes).
+
+        Returns:
+            bool: Whether all glyphs are loaded.
+        """
+        if self._loading_thread is not None:
+            self._loading_thread.join(timeout)
+        return self.is_complete
+
+    def stop_loading(self):
+        """Stops loading the rest of the glyphs of a progressive font (e.g. when the
+        font is replaced), the subset loaded so far is kept."""
+        self._stop_loading.set()
+
+    def fingerprint(self) -> str:
+        """Returns a hash of everything the query depends on (matched colors and
+        characters, widths, kerning and shape basis), fonts with equal fingerprints
+        convert images to the same text.
+
+        Returns:
+            str: Hexadecimal SHA-256 digest.
+        """
+        with self._reading_index():
+            return self._fingerprint()
+
+    def _fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(self.kdtree.data).tobytes())
+        state = [
+            sorted(self.index_char_dict.items()),
+            sorted(self.char_widths.items()),
+            None if self.kerning is None else sorted(self.kerning.items()),
+            self.is_monospace,
+            self.shape_grid,
+            self.ppem_ratio,
+            self.char_height,
+        ]
+        digest.update(json.dumps(state).encode("utf-8"))
+        if self.shape_grid > 1:
+            digest.update(self.shape_mean.tobytes())
+            digest.update(self.shape_basis.tobytes())
+        return digest.hexdigest()
+
     def get_font_aspect_ratio(self) -> float:
         """Returns the aspect ratio of the font.
 
@@ -306,27 +841,142 @@ class ImageQueryFont:
             font_aspect_ratio = self.max_char_width / row_height
             new_aspect_ratio = original_aspect_ratio / font_aspect_ratio
             num_cols = round(num_rows * new_aspect_ratio)
-            return num_cols + 1 if num_cols % 2 == 1 else num_cols, num_rows
+            num_cols = num_cols + 1 if num_cols % 2 == 1 else num_cols
+            # each character is matched against shape_grid x shape_grid pixels
+            return num_cols * self.shape_grid, num_rows * self.shape_grid
         num_cols = num_cols + 1 if num_cols % 2 == 1 else num_cols
         return num_cols, num_rows
 
-    def query(self, image: np.ndarray, distance_metric: str = "manhattan") -> str:
+    def query(
+        self,
+        image: np.ndarray,
+        distance_metric: str = "manhattan",
+        color_mode: str | None = None,
+        dither: str | None = None,
+    ) -> str:
         """Makes a string representation of the image using the font.
 
         Args:
             image (np.ndarray): Source image.
-            distance_metric (str, optional): Type of distance metric to be used.
-            Defaults to manhattan.
+            distance_metric (str, optional): Type of distance metric to be used, either
+            manhattan, euclidean (both in RGB) or cielab, oklab (perceptual, euclidean
+            in the color space). Defaults to manhattan.
+            color_mode (str | None, optional): If set ("truecolor" or "256"), characters
+            are colored by the source colors using ANSI escape codes. Defaults to None.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" (error diffusion) or "ordered" (Bayer matrix), reduces
+            banding of smooth gradients. Defaults to None.
 
         Returns:
             str: A string representation of the image using the font.
         """
-        distance_metrics = {"manhattan": 1, "euclidean": 2}
-        if distance_metric not in distance_metrics:
-            raise ValueError(
-                f"Invalid distance metric, use one of: {' '.join(distance_metrics.keys())}"
+        metric = self._get_metric(distance_metric)
+        check_color_mode(color_mode)
+        check_dither_mode(dither)
+        return "\n".join(self._query_rows(image, metric, color_mode, dither))
+
+    def query_batch(
+        self,
+        images: list[np.ndarray] | np.ndarray,
+        distance_metric: str = "manhattan",
+        color_mode: str | None = None,
+        dither: str | None = None,
+    ) -> list[str]:
+        """Makes string representations of multiple images at once. Images of the same
+        width are stacked and queried together, which saves the per query overhead
+        when the images are small (e.g. video frames with few characters).
+
+        Args:
+            images (list[np.ndarray] | np.ndarray): Source images, either a list or an
+            array of equally sized images (images, height, width, 3), which is queried
+            without copying the images into a stacked array.
+            distance_metric (str, optional): Type of distance metric to be used, either
+            manhattan, euclidean (both in RGB) or cielab, oklab (perceptual, euclidean
+            in the color space). Defaults to manhattan.
+            color_mode (str | None, optional): If set ("truecolor" or "256"), characters
+            are colored by the source colors using ANSI escape codes. Defaults to None.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" (error diffusion) or "ordered" (Bayer matrix), reduces
+            banding of smooth gradients. Defaults to None.
+
+        Returns:
+            list[str]: String representations of the images using the font.
+        """
+        metric = self._get_metric(distance_metric)
+        check_color_mode(color_mode)
+        check_dither_mode(dither)
+        if len(images) == 0:
+            return []
+        rows_per_image = [image.shape[0] // self.shape_grid for image in images]
+        if isinstance(images, np.ndarray):
+            # a view of the images as a single tall image (a copy only when rows of
+            # the images are cropped)
+            num_rows = rows_per_image[0]
+            stacked = images[:, : num_rows * self.shape_grid].reshape(
+                -1, *images.shape[2:]
+            )
+            rows = self._query_rows(stacked, metric, color_mode, dither, num_rows)
+            return [
+                "\n".join(rows[i * num_rows : (i + 1) * num_rows])
+                for i in range(len(images))
+            ]
+        # errors are diffused and the dither pattern repeats within frames of equal
+        # height only
+        if len({image.shape[1] for image in images}) > 1 or (
+            dither is not None and len(set(rows_per_image)) > 1
+        ):
+            return [
+                self.query(image, distance_metric, color_mode, dither)
+                for image in images
+            ]
+        # rows of the text are independent of each other, so the images can be queried
+        # as a single tall image and the result split back by rows
+        images = [
+            image[: rows * self.shape_grid]
+            for image, rows in zip(images, rows_per_image)
+        ]
+        rows = self._query_rows(
+            np.concatenate(images), metric, color_mode, dither, rows_per_image[0]
+        )
+        split_indices = np.cumsum(rows_per_image)
+        return [
+            "\n".join(rows[end - num_rows : end])
+            for num_rows, end in zip(rows_per_image, split_indices)
+        ]
+
+    def iter_query(
+        self,
+        image: np.ndarray,
+        distance_metric: str = "manhattan",
+        tile_rows: int = QUERY_TILE_ROWS,
+        color_mode: str | None = None,
+        dither: str | None = None,
+    ):
+        """Yields rows of the string representation of the image one by one. Rows are
+        queried in tiles, so only a single tile of the result is kept in memory
+        (errors of error diffusion dithering are not diffused across tiles).
+
+        Args:
+            image (np.ndarray): Source image.
+            distance_metric (str, optional): Type of distance metric to be used, either
+            manhattan, euclidean (both in RGB) or cielab, oklab (perceptual, euclidean
+            in the color space). Defaults to manhattan.
+            tile_rows (int, optional): Number of text rows queried at once.
+            Defaults to QUERY_TILE_ROWS.
+            color_mode (str | None, optional): If set ("truecolor" or "256"), characters
+            are colored by the source colors using ANSI escape codes. Defaults to None.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" (error diffusion) or "ordered" (Bayer matrix), reduces
+            banding of smooth gradients. Defaults to None.
+
+        Yields:
+            str: Rows of the string representation of the image.
+        """
+        metric = self._get_metric(distance_metric)
+        check_color_mode(color_mode)
+        check_dither_mode(dither)
+        tile_rows *= self.shape_grid
+        for start in range(0, image.shape[0], tile_rows):
+            yield from self._query_rows(
+                image[start : start + tile_rows], metric, color_mode, dither
             )
-        metric_index = distance_metrics[distance_metric]
-        if self.is_monospace:
-            return self._query_monospace(image, metric_index)
-        return self._query_non_monospace(image, metric_index)
@@ -0,0 +1,98 @@
+"""Module for converting small text previews of images, animations and videos."""
+
+import cv2
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from .constants import PREVIEW_CHARACTER_COUNT, PREVIEW_FRAME_COUNT
+from .helpers import estimate_new_size, resize_image
+from .image_query_font import ImageQueryFont
+
+
+def _spread_indices(frame_count: int, num_frames: int) -> list[int]:
+    # middles of equal parts of the media, so neither the first nor the last frame
+    # (often black) is used
+    return sorted(
+        {int((i + 0.5) * frame_count / num_frames) for i in range(num_frames)}
+    )
+
+
+def _video_cells(
+    font: ImageQueryFont,
+    video: str,
+    num_characters: int,
+    num_frames: int,
+    row_spacing: float,
+) -> np.ndarray:
+    capture = cv2.VideoCapture(video)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Unsupported media file: {video}")
+        original_size = (
+            int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        )
+        new_size = estimate_new_size(font, original_size, num_characters, row_spacing)
+        frame_count = max(1, int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        cells = []
+        for index in _spread_indices(frame_count, num_frames):
+            # the decoder seeks to the keyframe before the frame and decodes only
+            # from there, the rest of the video is never decoded
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            success, frame = capture.read()
+            if not success:
+                continue
+            frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
+            cells.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame))
+    finally:
+        capture.release()
+    if not cells:
+        raise ValueError(f"No frames could be read from: {video}")
+    return np.stack(cells)
+
+
+def create_preview(
+    font: ImageQueryFont,
+    media: str,
+    num_characters: int = PREVIEW_CHARACTER_COUNT,
+    num_frames: int = PREVIEW_FRAME_COUNT,
+    row_spacing: float = 1.0,
+    distance_metric: str = "manhattan",
+) -> list[str]:
+    """Function to convert a small preview of a media file, a single frame of images
+    and evenly spaced frames of animations and videos (decoded by seeking to them, not
+    by decoding the whole video).
+
+    Args:
+        font (ImageQueryFont): Font to use for conversion.
+        media (str): Path to an image, animated image or video.
+        num_characters (int, optional): Approximate number of characters per frame.
+        Defaults to PREVIEW_CHARACTER_COUNT.
+        num_frames (int, optional): Number of frames of animations and videos.
+        Defaults to PREVIEW_FRAME_COUNT.
+        row_spacing (float, optional): Spacing between rows. Defaults to 1.0.
+        distance_metric (str, optional): Distance metric to be used for query.
+        Defaults to "manhattan".
+
+    Raises:
+        ValueError: If the file is neither an image nor a readable video.
+
+    Returns:
+        list[str]: Converted frames of the preview.
+    """
+    try:
+        image = Image.open(media)
+    except UnidentifiedImageError:
+        cells = _video_cells(font, media, num_characters, num_frames, row_spacing)
+        return font.query_batch(cells, distance_metric)
+    with image:
+        new_size = estimate_new_size(font, image.size, num_characters, row_spacing)
+        frame_count = getattr(image, "n_frames", 1)
+        if frame_count == 1:
+            cells = [resize_image(image, new_size)]
+        else:
+            cells = []
+            for index in _spread_indices(frame_count, num_frames):
+                image.seek(index)
+                cells.append(resize_image(image.convert("RGB"), new_size))
+    return font.query_batch(np.stack(cells), distance_metric)
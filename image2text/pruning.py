@@ -0,0 +1,127 @@
+"""Module for pruning glyphs of a font to a compact, well spread set for the query."""
+
+import time
+
+import numpy as np
+from scipy.spatial import KDTree
+
+PRUNE_PRIORITIES = ("narrowest", "ascii")
+
+
+def check_prune_priority(priority: str):
+    """Function to check whether the pruning priority is valid.
+
+    Args:
+        priority (str): Priority to check.
+
+    Raises:
+        ValueError: If the priority is not one of PRUNE_PRIORITIES.
+    """
+    if priority not in PRUNE_PRIORITIES:
+        raise ValueError(
+            f"Invalid prune priority, use one of: {' '.join(PRUNE_PRIORITIES)}"
+        )
+
+
+def priority_order(
+    chars: list[str], widths: dict[str, int], priority: str
+) -> list[int]:
+    """Function to order glyphs from the most to the least preferred one.
+
+    Args:
+        chars (list[str]): Characters (or ligatures) of the glyphs.
+        widths (dict[str, int]): Widths of the characters in font units.
+        priority (str): Either "narrowest" (narrowest first, then ASCII first) or
+        "ascii" (ASCII first, then single characters before ligatures).
+
+    Returns:
+        list[int]: Indices of the glyphs, the most preferred first.
+    """
+    check_prune_priority(priority)
+
+    def ascii_key(i: int) -> tuple:
+        return (not chars[i].isascii(), len(chars[i]), chars[i])
+
+    if priority == "ascii":
+        return sorted(range(len(chars)), key=ascii_key)
+    return sorted(range(len(chars)), key=lambda i: (widths[chars[i]], ascii_key(i)))
+
+
+def merge_within_tolerance(
+    descriptors: np.ndarray, order: list[int], tolerance: float
+) -> list[int]:
+    """Function to merge glyphs closer to each other than the tolerance, glyphs are
+    visited in order of preference and each kept glyph removes all glyphs within the
+    tolerance from it, so of a group of similar glyphs the preferred one is kept.
+
+    Args:
+        descriptors (np.ndarray): Descriptors of the glyphs (glyphs, features).
+        order (list[int]): Indices of the glyphs, the most preferred first.
+        tolerance (float): Euclidean distance of glyphs considered the same.
+
+    Returns:
+        list[int]: Indices of the kept glyphs in order of preference.
+    """
+    kdtree = KDTree(descriptors)
+    removed = np.zeros(len(descriptors), dtype=bool)
+    kept = []
+    for i in order:
+        if removed[i]:
+            continue
+        kept.append(i)
+        removed[kdtree.query_ball_point(descriptors[i], tolerance)] = True
+    return kept
+
+
+def spread_sample(
+    descriptors: np.ndarray, candidates: list[int], count: int
+) -> list[int]:
+    """Function to choose glyphs covering the space of descriptors (farthest point
+    sampling), each chosen glyph is the one farthest from all glyphs chosen before.
+    The first candidate is chosen first and ties are resolved by the candidate order.
+
+    Args:
+        descriptors (np.ndarray): Descriptors of the glyphs (glyphs, features).
+        candidates (list[int]): Indices of the glyphs to choose from, the most
+        preferred first.
+        count (int): Number of glyphs to choose.
+
+    Returns:
+        list[int]: Indices of the chosen glyphs.
+    """
+    points = descriptors[candidates]
+    chosen = [0]
+    distances = np.linalg.norm(points - points[0], axis=1)
+    while len(chosen) < min(count, len(candidates)):
+        farthest = int(np.argmax(distances))
+        chosen.append(farthest)
+        np.minimum(
+            distances, np.linalg.norm(points - points[farthest], axis=1), out=distances
+        )
+    return [candidates[i] for i in chosen]
+
+
+def measure_query_speedup(
+    descriptors: np.ndarray, pruned_descriptors: np.ndarray, num_points: int = 4096
+) -> float:
+    """Function to measure how much faster a kd-tree query of the pruned glyphs is
+    than of all glyphs, by querying the same random colors in both.
+
+    Args:
+        descriptors (np.ndarray): Descriptors of all glyphs.
+        pruned_descriptors (np.ndarray): Descriptors of the kept glyphs.
+        num_points (int, optional): Number of queried points. Defaults to 4096.
+
+    Returns:
+        float: Query time of all glyphs divided by the one of the kept glyphs.
+    """
+    points = np.random.default_rng(0).uniform(
+        0, 255, (num_points, descriptors.shape[1])
+    )
+    times = []
+    for data in (descriptors, pruned_descriptors):
+        kdtree = KDTree(data)
+        start = time.perf_counter()
+        kdtree.query(points, p=1)
+        times.append(time.perf_counter() - start)
+    return times[0] / max(times[1], 1e-9)
@@ -0,0 +1,210 @@
+"""Module for rasterizing text made by a font back to pixels."""
+
+import re
+import subprocess
+from typing import TYPE_CHECKING
+
+import numpy as np
+from PIL import Image
+
+from .constants import PIPE_THREADS_SHARE
+from .image_query_font import ImageQueryFont
+from .scheduler import get_scheduler, scheduling_priority
+
+if TYPE_CHECKING:
+    from .video_convert import TextVideo
+
+ANSI_ESCAPE_PATTERN = re.compile("\x1b\\[[0-9;]*m")
+
+
+class TextRasterizer:
+    """Class for rasterizing text images and videos using a glyph atlas."""
+
+    def __init__(self, font: ImageQueryFont, row_spacing: float = 1.0):
+        """Function to create a rasterizer, all glyphs of the font are rendered once
+        (the same way they are rendered for matching) into a glyph atlas.
+
+        Args:
+            font (ImageQueryFont): Font the text was made with.
+            row_spacing (float, optional): Spacing between rows. Defaults to 1.0.
+        """
+        self.font = font
+        self.row_height = font.units_to_pixels(round(row_spacing * font.char_height))
+        chars = [char for char in font.index_char_dict.values() if char]
+        # index 0 is an empty cell used for unknown characters and padding
+        self.char_index = {char: i + 1 for i, char in enumerate(chars)}
+        self.glyphs = [self._fit_glyph(font.render_glyph(char)) for char in chars]
+        # how far each pixel of a glyph is from the background, where glyphs overlap
+        # the pixels furthest from it are kept
+        self.glyph_distances = [self._bg_distance(glyph) for glyph in self.glyphs]
+        if font.is_monospace:
+            self.cell_width = font.get_glyph_width(chars[0])
+            empty_cell = np.empty_like(self.glyphs[0])
+            empty_cell[:] = font.bg_color
+            self.atlas = np.stack([empty_cell] + self.glyphs)
+
+    def _fit_glyph(self, glyph: np.ndarray) -> np.ndarray:
+        if glyph.shape[0] >= self.row_height:
+            return glyph[: self.row_height]
+        padding = np.empty(
+            (self.row_height - glyph.shape[0], glyph.shape[1], 3), dtype=np.uint8
+        )
+        padding[:] = self.font.bg_color
+        return np.concatenate((glyph, padding))
+
+    def _bg_distance(self, image: np.ndarray) -> np.ndarray:
+        return np.abs(image.astype(np.int16) - self.font.bg_color).sum(axis=2)
+
+    def _split_rows(self, text: str) -> list[list[str]]:
+        text = ANSI_ESCAPE_PATTERN.sub("", text)
+        # characters are separated by \u200a, empty ones are out of bounds dummies
+        return [
+            [char for char in row.split("\u200a") if char] for row in text.split("\n")
+        ]
+
+    def _rasterize_monospace(self, rows: list[list[str]]) -> np.ndarray:
+        num_cols = max(1, max(len(row) for row in rows))
+        indices = np.zeros((len(rows), num_cols), dtype=np.intp)
+        for i, row in enumerate(rows):
+            indices[i, : len(row)] = [self.char_index.get(char, 0) for char in row]
+        cells = self.atlas[indices]
+        # (rows, cols, height, width, 3) -> (rows * height, cols * width, 3)
+        return cells.transpose(0, 2, 1, 3, 4).reshape(
+            len(rows) * self.row_height, num_cols * self.cell_width, 3
+        )
+
+    def _rasterize_non_monospace(self, rows: list[list[str]]) -> np.ndarray:
+        kerning = self.font.kerning or {}
+        placements = []
+        width = 1
+        for row in rows:
+            row_placements = []
+            offset = 0  # in font units, converted to pixels only when placing a glyph
+            previous_char = ""
+            for char in row:
+                if char not in self.char_index:
+                    continue
+                offset += kerning.get(previous_char + char, 0)
+                index = self.char_index[char] - 1
+                glyph = self.glyphs[index]
+                x = max(0, self.font.units_to_pixels(offset))
+                row_placements.append((x, glyph, self.glyph_distances[index]))
+                width = max(width, x + glyph.shape[1])
+                offset += self.font.char_widths[char]
+                previous_char = char
+            placements.append(row_placements)
+        canvas = np.empty((len(rows) * self.row_height, width, 3), dtype=np.uint8)
+        canvas[:] = self.font.bg_color
+        for i, row_placements in enumerate(placements):
+            y = i * self.row_height
+            rows_slice = slice(y, y + self.row_height)
+            row_end = 0
+            for x, glyph, glyph_distances in row_placements:
+                end = x + glyph.shape[1]
+                # glyph boxes overlap with kerning or negative bearings, there the
+                # background of a glyph must not wipe out the glyph before it, each
+                # pixel keeps the color furthest from the background
+                overlap = max(0, min(row_end, end) - x)
+                if overlap > 0:
+                    region = canvas[rows_slice, x : x + overlap]
+                    mask = glyph_distances[:, :overlap] > self._bg_distance(region)
+                    region[mask] = glyph[:, :overlap][mask]
+                canvas[rows_slice, x + overlap : end] = glyph[:, overlap:]
+                row_end = max(row_end, end)
+        return canvas
+
+    def rasterize(self, text: str) -> np.ndarray:
+        """Rasterizes text made by the font (ANSI colors are ignored).
+
+        Args:
+            text (str): Text to rasterize.
+
+        Returns:
+            np.ndarray: RGB image of the text.
+        """
+        rows = self._split_rows(text)
+        if self.font.is_monospace:
+            return self._rasterize_monospace(rows)
+        return self._rasterize_non_monospace(rows)
+
+    def _fit_frame(self, frame: np.ndarray, height: int, width: int) -> np.ndarray:
+        if frame.shape[0] == height and frame.shape[1] == width:
+            return frame
+        fitted = np.empty((height, width, 3), dtype=np.uint8)
+        fitted[:] = self.font.bg_color
+        height, width = min(height, frame.shape[0]), min(width, frame.shape[1])
+        fitted[:height, :width] = frame[:height, :width]
+        return fitted
+
+    def save_image(self, text: str, path: str):
+        """Function to save rasterized text as an image.
+
+        Args:
+            text (str): Text to rasterize.
+            path (str): Path to save the image (format is given by the extension).
+        """
+        Image.fromarray(self.rasterize(text)).save(path)
+
+    def save_video(self, video: "TextVideo", path: str):
+        """Function to save rasterized text video as a video, raw frames are piped
+        straight into an FFmpeg encoder. All frames have the size of the first frame.
+
+        Args:
+            video (TextVideo): Text video to rasterize (from its start).
+            path (str): Path to save the video.
+        """
+        # the threads started by set time convert with the priority it is called in
+        with scheduling_priority("background"):
+            video.set_time(0)
+        frame = self.rasterize(video.next_frame())
+        # yuv420p requires even dimensions
+        height = frame.shape[0] + frame.shape[0] % 2
+        width = frame.shape[1] + frame.shape[1] % 2
+        scheduler = get_scheduler()
+        # held until the encoder ends, it waits for the frames being converted
+        threads = scheduler.acquire(
+            max(1, int(scheduler.budget * PIPE_THREADS_SHARE)),
+            "background",
+            long_running=True,
+        )
+        ffmpeg_command = [
+            "ffmpeg",
+            "-y",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(video.frame_rate),
+            "-i",
+            "-",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-pix_fmt",
+            "yuv420p",
+            "-threads",
+            str(threads),
+            path,
+        ]
+        try:
+            with subprocess.Popen(
+                ffmpeg_command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            ) as process:
+                while True:
+                    process.stdin.write(self._fit_frame(frame, height, width).tobytes())
+                    try:
+                        frame = self.rasterize(video.next_frame())
+                    except StopIteration:
+                        break
+                process.stdin.close()
+        finally:
+            scheduler.release(threads, long_running=True)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, ffmpeg_command)
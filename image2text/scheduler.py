@@ -0,0 +1,217 @@
+"""Module for sharing the CPU between FFmpeg processes, kd-tree queries and conversion
+threads of all conversions running in the process."""
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from .constants import INTERACTIVE_SHARE
+
+PRIORITIES = ("interactive", "background")
+
+# priority of the work started in the current context (thread)
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "scheduling_priority", default="interactive"
+)
+
+
+def check_priority(priority: str):
+    """Function to check whether the scheduling priority is valid.
+
+    Args:
+        priority (str): Priority to check.
+
+    Raises:
+        ValueError: If the priority is not one of PRIORITIES.
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Invalid priority, use one of: {' '.join(PRIORITIES)}")
+
+
+@contextmanager
+def scheduling_priority(priority: str) -> Iterator[None]:
+    """Context manager setting the priority of the work started inside it, including
+    the threads started by videos, streams and animations created or seeked in it.
+
+    Args:
+        priority (str): Either "interactive" (playback) or "background" (renders).
+    """
+    check_priority(priority)
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def get_priority() -> str:
+    """Get the scheduling priority of the current context.
+
+    Returns:
+        str: Either "interactive" or "background".
+    """
+    return _priority.get()
+
+
+def start_thread(target: Callable, *args) -> threading.Thread:
+    """Function to start a daemon thread in a copy of the current context, so the
+    work it does keeps the priority of the code that started it.
+
+    Args:
+        target (Callable): Function run by the thread.
+        *args: Arguments of the function.
+
+    Returns:
+        threading.Thread: Started thread.
+    """
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(target, *args), daemon=True
+    )
+    thread.start()
+    return thread
+
+
+class ResourceScheduler:
+    """Class for sharing a budget of CPU threads. Short work (queries) waits until
+    threads are free, long running processes (FFmpeg pipes and chunk encodes) are given
+    a share of the free threads right away and never keep short work from starting."""
+
+    def __init__(
+        self, budget: int | None = None, interactive_share: float | None = None
+    ):
+        """Function to create a scheduler.
+
+        Args:
+            budget (int | None, optional): Total number of threads. Defaults to None
+            (number of CPUs).
+            interactive_share (float | None, optional): Share of the budget that
+            background work never uses, so playback can start right away. Defaults to
+            None (INTERACTIVE_SHARE).
+        """
+        self.budget = max(1, budget or os.cpu_count() or 1)
+        if interactive_share is None:
+            interactive_share = INTERACTIVE_SHARE
+        self.background_limit = max(
+            1, self.budget - max(1, round(self.budget * interactive_share))
+        )
+        self._condition = threading.Condition()
+        self._active = 0
+        self._long_running = 0
+        self._waiting = dict.fromkeys(PRIORITIES, 0)
+
+    def _can_start(self, priority: str, limit: int) -> bool:
+        if priority == "background" and self._waiting["interactive"] > 0:
+            return False
+        # short work never waits while holding threads, so it can always start when
+        # no other short work is running (long running processes can't block it)
+        return self._active == 0 or self._active + self._long_running < limit
+
+    def acquire(
+        self, threads: int, priority: str | None = None, long_running: bool = False
+    ) -> int:
+        """Acquire up to the given number of threads, waits until at least one is free
+        (unless long running).
+
+        Args:
+            threads (int): Number of threads the work could use.
+            priority (str | None, optional): Priority of the work. Defaults to None
+            (priority of the current context).
+            long_running (bool, optional): Whether the threads are held by a process
+            that waits for other work (e.g. an FFmpeg pipe). Defaults to False.
+
+        Returns:
+            int: Number of threads granted (at least 1), has to be released.
+        """
+        priority = get_priority() if priority is None else priority
+        check_priority(priority)
+        limit = self.budget if priority == "interactive" else self.background_limit
+        with self._condition:
+            if not long_running:
+                self._waiting[priority] += 1
+                try:
+                    self._condition.wait_for(lambda: self._can_start(priority, limit))
+                finally:
+                    self._waiting[priority] -= 1
+            granted = max(1, min(threads, limit - self._active - self._long_running))
+            if long_running:
+                self._long_running += granted
+            else:
+                self._active += granted
+            return granted
+
+    def release(self, threads: int, long_running: bool = False):
+        """Release threads acquired before.
+
+        Args:
+            threads (int): Number of threads granted by acquire.
+            long_running (bool, optional): Whether they were acquired as long running.
+            Defaults to False.
+        """
+        with self._condition:
+            if long_running:
+                self._long_running -= threads
+            else:
+                self._active -= threads
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(
+        self, threads: int, priority: str | None = None, long_running: bool = False
+    ) -> Iterator[int]:
+        """Context manager acquiring threads for the work done inside it.
+
+        Args:
+            threads (int): Number of threads the work could use.
+            priority (str | None, optional): Priority of the work. Defaults to None
+            (priority of the current context).
+            long_running (bool, optional): See acquire. Defaults to False.
+
+        Yields:
+            int: Number of threads granted (at least 1).
+        """
+        granted = self.acquire(threads, priority, long_running)
+        try:
+            yield granted
+        finally:
+            self.release(granted, long_running)
+
+    def stats(self) -> dict:
+        """Get the current usage of the budget.
+
+        Returns:
+            dict: Budget, threads used by short and long running work and the number
+            of waiting requests of each priority.
+        """
+        with self._condition:
+            return {
+                "budget": self.budget,
+                "background_limit": self.background_limit,
+                "active": self._active,
+                "long_running": self._long_running,
+                "waiting": dict(self._waiting),
+            }
+
+
+_scheduler = ResourceScheduler()
+
+
+def get_scheduler() -> ResourceScheduler:
+    """Get the scheduler shared by all conversions of the process.
+
+    Returns:
+        ResourceScheduler: Shared scheduler.
+    """
+    return _scheduler
+
+
+def set_scheduler(scheduler: ResourceScheduler):
+    """Replace the shared scheduler (e.g. to change the CPU budget), work that already
+    acquired threads releases them to the previous one.
+
+    Args:
+        scheduler (ResourceScheduler): New shared scheduler.
+    """
+    global _scheduler  # pylint: disable=global-statement
+    _scheduler = scheduler
@@ -0,0 +1,293 @@
+"""Module for converting a live stream of video frames to text."""
+
+import queue
+import subprocess
+import threading
+from typing import BinaryIO
+
+import cv2
+import numpy as np
+
+from .ansi import check_color_mode
+from .constants import PIPE_THREADS_SHARE, PROCESS_REFRESH_RATE, QUERY_BATCH_SIZE
+from .dithering import check_dither_mode
+from .helpers import estimate_new_size
+from .image_query_font import ImageQueryFont
+from .scheduler import get_scheduler, start_thread
+
+# because cv2 is a C module...
+# pylint: disable=maybe-no-member
+
+
+def _read_exactly(source: BinaryIO, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = source.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+class TextStream:
+    """Class for converting a live stream of frames to text with minimal latency."""
+
+    def __init__(
+        self,
+        font: ImageQueryFont,
+        source: BinaryIO | str,
+        frame_size: tuple[int, int] | None = None,
+        frame_rate: int = 30,
+        num_characters_per_frame: int = 5000,
+        row_spacing: float = 1.0,
+        distance_metric: str = "manhattan",
+        buffer_size: int = 2,
+        color_mode: str | None = None,
+        batch_size: int = QUERY_BATCH_SIZE,
+        dither: str | None = None,
+    ):
+        """Function to start converting a stream of frames to text.
+
+        Args:
+            font (ImageQueryFont): Font to use for conversion.
+            source (BinaryIO | str): Either a binary stream of raw RGB frames (rgb24)
+            of frame_size, or a path/URL of any media FFmpeg can read (read by a single
+            long-running FFmpeg process).
+            frame_size (tuple[int, int] | None, optional): Size (width, height) of raw
+            frames, required for binary stream sources. Defaults to None.
+            frame_rate (int, optional): Frame rate FFmpeg sources are sampled at.
+            Defaults to 30.
+            num_characters_per_frame (int, optional): Approximate number of characters
+            per frame. Defaults to 5000.
+            row_spacing (float, optional): Spacing between rows. Defaults to 1.0.
+            distance_metric (str, optional): Distance metric to be used for query.
+            Defaults to "manhattan".
+            buffer_size (int, optional): Maximum number of frames waiting in each of
+            the (raw and converted) queues, when full reading of the source is paused.
+            Defaults to 2.
+            color_mode (str | None, optional): ANSI color mode of the output, either
+            "truecolor", "256" or None for plain text. Defaults to None.
+            batch_size (int, optional): Maximum number of already waiting frames
+            queried at once. Defaults to QUERY_BATCH_SIZE.
+            dither (str | None, optional): Dithering of the query, either
+            "floyd-steinberg" or "ordered". Defaults to None.
+        """
+        # invalid settings would only fail in the conversion thread
+        if batch_size < 1:
+            raise ValueError(f"Batch size must be at least 1: {batch_size}")
+        font._get_metric(distance_metric)  # pylint: disable=protected-access
+        check_color_mode(color_mode)
+        check_dither_mode(dither)
+        self.font = font
+        self.frame_rate = frame_rate
+        self.distance_metric = distance_metric
+        self.color_mode = color_mode
+        self.batch_size = batch_size
+        self.dither = dither
+        self._process = None
+        self._process_lock = threading.Lock()
+        self._ffmpeg_threads = 0
+        if isinstance(source, str):
+            video_capture = cv2.VideoCapture(source)
+            original_size = (
+                int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            )
+            video_capture.release()
+            if 0 in original_size:
+                raise ValueError(f"Could not read frame size of: {source}")
+            self.new_size = estimate_new_size(
+                font, original_size, num_characters_per_frame, row_spacing
+            )
+            # held until the process ends, it waits for the conversion to read frames
+            self._scheduler = get_scheduler()
+            self._ffmpeg_threads = self._scheduler.acquire(
+                max(1, int(self._scheduler.budget * PIPE_THREADS_SHARE)),
+                long_running=True,
+            )
+            try:
+                self._process = subprocess.Popen(
+                    [
+                        "ffmpeg",
+                        "-threads",
+                        str(self._ffmpeg_threads),
+                        "-i",
+                        source,
+                        "-vf",
+                        f"fps={frame_rate},"
+                        + f" scale={self.new_size[0]}:{self.new_size[1]}:flags=lanczos",
+                        "-f",
+                        "rawvideo",
+                        "-pix_fmt",
+                        "rgb24",
+                        "-threads",
+                        str(self._ffmpeg_threads),
+                        "-",
+                    ],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                )
+            except BaseException:
+                # the threads would never be given back without a process
+                self._end_process()
+                raise
+            source = self._process.stdout
+            frame_size = self.new_size
+        elif frame_size is None:
+            raise ValueError("Frame size is required for raw frame streams")
+        else:
+            self.new_size = estimate_new_size(
+                font, frame_size, num_characters_per_frame, row_spacing
+            )
+        self._stopped = False
+        self._ended = False
+        # error of the reading or converting thread, raised by next_frame
+        self._error = None
+        self._frames = queue.Queue(buffer_size)
+        self._texts = queue.Queue(buffer_size)
+        start_thread(self._read_frames, source, frame_size)
+        start_thread(self._convert_frames)
+
+    def _should_stop(self) -> bool:
+        return self._stopped or self._error is not None
+
+    def _put(self, items: queue.Queue, item) -> bool:
+        # waits for space in the queue, unless the stream was stopped or failed
+        while not self._should_stop():
+            try:
+                items.put(item, timeout=PROCESS_REFRESH_RATE)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get_frame(self) -> np.ndarray | None:
+        while not self._should_stop():
+            try:
+                return self._frames.get(timeout=PROCESS_REFRESH_RATE)
+            except queue.Empty:
+                pass
+        return None
+
+    def _end_process(self):
+        # called by both the reading thread and stop, threads are released only once
+        with self._process_lock:
+            if self._ffmpeg_threads == 0:
+                return
+            if self._process is not None:
+                self._process.kill()
+                self._process.wait()
+            self._scheduler.release(self._ffmpeg_threads, long_running=True)
+            self._ffmpeg_threads = 0
+
+    def _read_frames(self, source: BinaryIO, frame_size: tuple[int, int]):
+        frame_bytes = frame_size[0] * frame_size[1] * 3
+        try:
+            while not self._should_stop():
+                data = _read_exactly(source, frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                frame = np.frombuffer(data, dtype=np.uint8).reshape(
+                    frame_size[1], frame_size[0], 3
+                )
+                if frame_size != self.new_size:
+                    frame = cv2.resize(
+                        frame, self.new_size, interpolation=cv2.INTER_AREA
+                    )
+                # waits when the queue is full, which in turn blocks the source
+                if not self._put(self._frames, frame):
+                    break
+        except Exception as e:  # pylint: disable=broad-except
+            self._error = e
+        finally:
+            self._end_process()
+            self._put(self._frames, None)
+
+    def _convert_frames(self):
+        try:
+            self._convert_batches()
+        except Exception as e:  # pylint: disable=broad-except
+            self._error = e
+        finally:
+            # the end is always signaled, so waiting for the next frame never hangs
+            while not self._stopped:
+                try:
+                    self._texts.put(None, timeout=PROCESS_REFRESH_RATE)
+                    break
+                except queue.Full:
+                    pass
+
+    def _convert_batches(self):
+        # frames of a batch are copied into a reused array instead of being stacked
+        # into a new one for every batch
+        batch = None
+        ended = False
+        while not ended:
+            frame = self._get_frame()
+            if frame is None:
+                break
+            if batch is None:
+                batch = np.empty((self.batch_size, *frame.shape), dtype=frame.dtype)
+            # frames that are already waiting are converted together
+            batch[0] = frame
+            num_frames = 1
+            while num_frames < self.batch_size:
+                try:
+                    frame = self._frames.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is None:
+                    ended = True
+                    break
+                batch[num_frames] = frame
+                num_frames += 1
+            texts = self.font.query_batch(
+                batch[:num_frames], self.distance_metric, self.color_mode, self.dither
+            )
+            for text in texts:
+                if not self._put(self._texts, text.encode("utf-8")):
+                    return
+
+    def next_frame(self) -> str:
+        """Get the next frame of the stream (waits for it if necessary).
+
+        Returns:
+            str: Next frame of the stream.
+        """
+        return self.next_frame_bytes().decode("utf-8")
+
+    def next_frame_bytes(self) -> bytes:
+        """Get the next frame of the stream without decoding it.
+
+        Raises:
+            ValueError: If the stream has been stopped.
+            StopIteration: If the stream ended.
+
+        Returns:
+            bytes: Next frame of the stream (UTF-8 encoded).
+        """
+        if self._ended:
+            raise StopIteration
+        while True:
+            if self._stopped:
+                raise ValueError("Stream has been stopped")
+            try:
+                frame_bytes = self._texts.get(timeout=PROCESS_REFRESH_RATE)
+                break
+            except queue.Empty:
+                pass
+        if frame_bytes is None:
+            self._ended = True
+            if self._error is not None:
+                # errors of the threads are raised once, instead of just ending
+                raise self._error
+            raise StopIteration
+        return frame_bytes
+
+    def stop(self):
+        """Stop the stream (cannot be resumed), the threads end shortly after (a thread
+        reading a raw frame stream ends when the next read from it returns)."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._end_process()
@@ -0,0 +1,109 @@
+"""Module for playing text videos in a terminal."""
+
+import sys
+import time
+from typing import TYPE_CHECKING, BinaryIO
+
+if TYPE_CHECKING:
+    from .video_convert import TextVideo
+
+CURSOR_HOME = b"\x1b[H"
+CLEAR_SCREEN = b"\x1b[2J"
+CLEAR_LINE_END = b"\x1b[K"
+CLEAR_SCREEN_END = b"\x1b[J"
+HIDE_CURSOR = b"\x1b[?25l"
+SHOW_CURSOR = b"\x1b[?25h"
+
+
+class TerminalPlayer:
+    """Class for playing text videos in a terminal with frame pacing and
+    differential redraw."""
+
+    def __init__(self, frame_rate: int, output: BinaryIO | None = None):
+        """Function to create a terminal player.
+
+        Args:
+            frame_rate (int): Frame rate to play the video at.
+            output (BinaryIO | None, optional): Binary stream of the terminal.
+            Defaults to sys.stdout.buffer.
+        """
+        self.frame_rate = frame_rate
+        self.output = output if output is not None else sys.stdout.buffer
+        self.drawn_frames = 0
+        self.dropped_frames = 0
+        self._lines: list[bytes] = []
+
+    def _move_cursor(self, row: int) -> bytes:
+        return f"\x1b[{row + 1};1H".encode("ascii")
+
+    def draw(self, frame: str | bytes):
+        """Draw a frame, rewriting only the lines that changed since the last one.
+
+        Args:
+            frame (str | bytes): Frame to draw (bytes must be UTF-8 encoded).
+        """
+        if isinstance(frame, str):
+            frame = frame.encode("utf-8")
+        lines = frame.split(b"\n")
+        parts = [] if self._lines else [CLEAR_SCREEN, CURSOR_HOME]
+        for i, line in enumerate(lines):
+            if i < len(self._lines) and self._lines[i] == line:
+                continue
+            parts += [self._move_cursor(i), line, CLEAR_LINE_END]
+        if len(lines) < len(self._lines):
+            parts += [self._move_cursor(len(lines)), CLEAR_SCREEN_END]
+        self._lines = lines
+        # whole frame in a single write, so the terminal never shows half a frame
+        self.output.write(b"".join(parts))
+        self.output.flush()
+        self.drawn_frames += 1
+
+    def play(self, video: "TextVideo") -> float:
+        """Play the video until its end. Frames that are late by more than one frame
+        period are dropped to keep the playback in sync, as long as the next frames
+        are already waiting. When the video itself can't keep up (a slow source or a
+        stall) nothing is dropped, the playback is synced to the late frame instead.
+
+        Args:
+            video (TextVideo): Video to play.
+
+        Returns:
+            float: Achieved frame rate (drawn frames per second).
+        """
+        frame_period = 1 / self.frame_rate
+        self.output.write(HIDE_CURSOR)
+        # the clock starts at the first frame, so waiting for it is not counted
+        first_frame_time = None
+        start_time = 0.0
+        last_draw_time = 0.0
+        frame_number = 0
+        try:
+            while True:
+                try:
+                    frame = video.next_frame_bytes()
+                except StopIteration:
+                    break
+                now = time.perf_counter()
+                if first_frame_time is None:
+                    first_frame_time = start_time = last_draw_time = now
+                delay = start_time + frame_number * frame_period - now
+                if delay < -frame_period:
+                    if now - last_draw_time < frame_period:
+                        # frames are waiting, skipping them catches up
+                        frame_number += 1
+                        self.dropped_frames += 1
+                        continue
+                    # the video is late itself, the clock is synced to this frame
+                    start_time = now - frame_number * frame_period
+                frame_number += 1
+                if delay > 0:
+                    time.sleep(delay)
+                self.draw(frame)
+                last_draw_time = time.perf_counter()
+        finally:
+            self.output.write(self._move_cursor(len(self._lines)) + SHOW_CURSOR)
+            self.output.flush()
+        if first_frame_time is None:
+            return 0.0
+        elapsed = time.perf_counter() - first_frame_time
+        return self.drawn_frames / elapsed if elapsed > 0 else 0.0
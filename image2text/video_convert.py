@@ -1,25 +1,41 @@
 """Module for converting an image to text using a font."""
 
+import itertools
+import json
 import os
 import queue
+import shutil
 import subprocess
 import sys
 import tempfile
 import threading
 import time
 from enum import Enum
+from typing import BinaryIO
 
 import cv2
+import numpy as np
 
 from .constants import (
     BYTE_ORDER,
+    CELL_CACHE_HEADER_SIZE,
+    CELL_CACHE_MAGIC_NUMBER,
     INT_SIZE,
+    PIPE_THREADS_SHARE,
     PROCESS_REFRESH_RATE,
-    RENDER_TEMP_DIR,
+    QUERY_BATCH_SIZE,
+    RENDER_MANIFEST_SUFFIX,
+    RENDER_MANIFEST_VERSION,
     TEXT_VIDEO_MAGIC_NUMBER,
 )
-from .helpers import estimate_new_size
+from .helpers import estimate_new_size, get_render_temp_dir
 from .image_query_font import ImageQueryFont
+from .scheduler import (
+    get_priority,
+    get_scheduler,
+    scheduling_priority,
+    start_thread,
+)
 
 # because cv2 is a C module...
 # pylint: disable=maybe-no-member
@@ -46,9 +62,14 @@ class VideoChunk:
         new_size: tuple[int, int],
     ):
         chunk_file = tempfile.NamedTemporaryFile(
-            dir=RENDER_TEMP_DIR, prefix=f"s{start_time}_", suffix=".mkv", delete=False
+            dir=get_render_temp_dir(),
+            prefix=f"s{start_time}_",
+            suffix=".mkv",
+            delete=False,
         )
         self.name = chunk_file.name
+        # chunks are encoded with the priority of the code that asked for them
+        self.priority = get_priority()
         self.ffmpeg_command = [
             "ffmpeg",
             "-ss",
@@ -75,13 +96,30 @@ class VideoChunk:
         if self.status in (VideoChunkStatus.READY, VideoChunkStatus.DELETED):
             return
         self.status = VideoChunkStatus.RUNNING
+        scheduler = get_scheduler()
         try:
-            subprocess.run(
-                self.ffmpeg_command,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=True,
-            )
+            # long running with a capped share, so queries of the frames already
+            # decoded are not kept waiting until the whole chunk is encoded
+            with scheduler.reserve(
+                max(1, int(scheduler.budget * PIPE_THREADS_SHARE)),
+                self.priority,
+                long_running=True,
+            ) as threads:
+                # same number of threads for decoding (input) and encoding (output)
+                subprocess.run(
+                    [
+                        "ffmpeg",
+                        "-threads",
+                        str(threads),
+                        *self.ffmpeg_command[1:-1],
+                        "-threads",
+                        str(threads),
+                        self.name,
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=True,
+                )
         except subprocess.CalledProcessError as e:
             if os.path.exists(self.name):
                 os.remove(self.name)
@@ -118,12 +156,13 @@ class VideoChunkHandler:
         self.curr_chunk: VideoChunk = None
         self.next_chunk: VideoChunk = None
         video_capture = cv2.VideoCapture(video)
-        self.video_length = int(
-            video_capture.get(cv2.CAP_PROP_FRAME_COUNT)
-            / video_capture.get(cv2.CAP_PROP_FPS)
-        )
+        # not truncated to whole seconds, the last chunk holds the rest of the video
+        self.video_length = video_capture.get(
+            cv2.CAP_PROP_FRAME_COUNT
+        ) / video_capture.get(cv2.CAP_PROP_FPS)
+        video_capture.release()
         self._stopped = False
-        threading.Thread(target=self._process_chunks, daemon=True).start()
+        start_thread(self._process_chunks)
         self.set_time(0)
 
     def _process_chunks(self):
@@ -198,7 +237,8 @@ class VideoChunkHandler:
                 success, frame = video_capture.read()
                 if not success:
                     break
-                yield frame
+                # converted in place, frames are not copied before the query
+                yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
             if self.next_chunk_time >= self.video_length:
                 break
             self._next_chunk()
@@ -217,8 +257,15 @@ class TextVideo:
         distance_metric: str = "manhattan",
         chunk_length: int = 5,
         buffer_size: int = 100,
+        color_mode: str | None = None,
+        buffer_bytes: int | None = None,
+        batch_size: int = QUERY_BATCH_SIZE,
+        dither: str | None = None,
     ):
+        if batch_size < 1:
+            raise ValueError(f"Batch size must be at least 1: {batch_size}")
         self.from_render = False
+        self.from_cell_cache = False
         with open(video, "rb") as file:
             magic_number = int.from_bytes(file.read(INT_SIZE), BYTE_ORDER)
             if magic_number == TEXT_VIDEO_MAGIC_NUMBER:
@@ -226,6 +273,11 @@ class TextVideo:
                 self.frame_rate = int.from_bytes(file.read(INT_SIZE), BYTE_ORDER)
                 self.frame_count = int.from_bytes(file.read(INT_SIZE), BYTE_ORDER)
                 self.frames_offset = 3 * INT_SIZE + self.frame_count * INT_SIZE
+            elif magic_number == CELL_CACHE_MAGIC_NUMBER:
+                self.from_cell_cache = True
+                frame_rate, frame_count, width, height = (
+                    int.from_bytes(file.read(INT_SIZE), BYTE_ORDER) for _ in range(4)
+                )
         if self.from_render:
             self.file_pointer = open(video, "rb")
             self._frame_generator = self._iter_frames_from_render()
@@ -236,20 +288,38 @@ class TextVideo:
         self.video = video
         self.frame_rate = frame_rate
         self.distance_metric = distance_metric
+        self.color_mode = color_mode
+        self.dither = dither
         self.chunk_length = chunk_length
         self.buffer_size = buffer_size
-        video_capture = cv2.VideoCapture(video)
-        original_size = (
-            int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
-            int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-        )
-        video_capture.release()
-        self.new_size = estimate_new_size(
-            font, original_size, num_characters_per_frame, row_spacing
-        )
-        self._video_chunk_handler = VideoChunkHandler(
-            video, frame_rate, self.new_size, chunk_length
-        )
+        self.buffer_bytes = buffer_bytes
+        self.batch_size = batch_size
+        self._frame_number = 0
+        self._buffer_stop_event = threading.Event()
+        if self.from_cell_cache:
+            self.new_size = (width, height)
+            self.video_length = frame_count / frame_rate
+            self._cell_frames = np.memmap(
+                video,
+                dtype=np.uint8,
+                mode="r",
+                offset=CELL_CACHE_HEADER_SIZE,
+                shape=(frame_count, height, width, 3),
+            )
+        else:
+            video_capture = cv2.VideoCapture(video)
+            original_size = (
+                int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            )
+            video_capture.release()
+            self.new_size = estimate_new_size(
+                font, original_size, num_characters_per_frame, row_spacing
+            )
+            self._video_chunk_handler = VideoChunkHandler(
+                video, frame_rate, self.new_size, chunk_length
+            )
+            self.video_length = self._video_chunk_handler.video_length
         self._frame_generator = self._iter_frames_from_video()
         self._stopped = False
 
@@ -270,42 +340,105 @@ class TextVideo:
         """
         if self._stopped:
             raise ValueError("Video player has been stopped")
-        if new_time < 0 or (
-            not self.from_render and new_time >= self._video_chunk_handler.video_length
-        ):
+        if new_time < 0 or (not self.from_render and new_time >= self.video_length):
             return
-        if not self.from_render:
-            self._set_time_from_video(new_time)
-        else:
+        if self.from_render:
             self._set_time_from_render(new_time)
-        self._frame_generator = (
-            self._iter_frames_from_video()
-            if not self.from_render
-            else self._iter_frames_from_render()
-        )
+            self._frame_generator = self._iter_frames_from_render()
+            return
+        if not self.from_cell_cache:
+            self._set_time_from_video(new_time)
+        self._frame_number = new_time * self.frame_rate
+        self._frame_generator = self._iter_frames_from_video()
+
+    def _next_batch_size(self, q: queue.Queue, buffered_bytes: int) -> int:
+        if self.buffer_bytes is not None and buffered_bytes >= self.buffer_bytes:
+            return 0
+        # the consumer is waiting, so a single frame is converted as soon as possible
+        if q.empty():
+            return 1
+        return min(self.batch_size, self.buffer_size - q.qsize())
+
+    def _iter_cell_frames(self, start_frame: int):
+        if self.from_cell_cache:
+            for frame_number in range(start_frame, len(self._cell_frames)):
+                yield self._cell_frames[frame_number]
+            return
+        yield from self._video_chunk_handler.iter_frames()
 
     def _iter_frames_from_video(self):
+        # stopping the buffering thread of the previous frame generator
+        self._buffer_stop_event.set()
+        stop_event = threading.Event()
+        self._buffer_stop_event = stop_event
+        self._frames_ended = False
+        # frames are buffered UTF-8 encoded, the form in which they are saved or
+        # printed anyway, so they are never encoded again (it is not smaller than str,
+        # the hair space separator takes 3 bytes)
         q = queue.Queue(self.buffer_size)
-        video_frame_generator = self._video_chunk_handler.iter_frames()
+        buffered_bytes = [0]
+        buffered_bytes_lock = threading.Lock()
+        cell_frame_generator = self._iter_cell_frames(self._frame_number)
 
         def buffer_frames():
-            while True:
-                if q.qsize() < self.buffer_size:
-                    try:
-                        frame = next(video_frame_generator)
-                    except StopIteration:
+            try:
+                convert_frames()
+            except Exception as e:  # pylint: disable=broad-except
+                q.put(e)
+                return
+            if not stop_event.is_set():
+                # the end of the video, as opposed to the buffer running late
+                q.put(None)
+
+        def convert_frames():
+            # frames of a batch are copied into a reused array instead of being
+            # stacked into a new one for every batch
+            batch = None
+            while not stop_event.is_set():
+                batch_size = self._next_batch_size(q, buffered_bytes[0])
+                if batch_size > 0:
+                    # several frames queried at once save the per query overhead
+                    num_frames = 0
+                    for frame in itertools.islice(cell_frame_generator, batch_size):
+                        if batch is None:
+                            batch = np.empty(
+                                (self.batch_size, *frame.shape), dtype=frame.dtype
+                            )
+                        batch[num_frames] = frame
+                        num_frames += 1
+                    if num_frames == 0:
                         break
-                    q.put(self.font.query(frame, self.distance_metric))
+                    texts = self.font.query_batch(
+                        batch[:num_frames],
+                        self.distance_metric,
+                        self.color_mode,
+                        self.dither,
+                    )
+                    for text in texts:
+                        frame_bytes = text.encode("utf-8")
+                        with buffered_bytes_lock:
+                            buffered_bytes[0] += len(frame_bytes)
+                        q.put(frame_bytes)
                 else:
                     time.sleep(PROCESS_REFRESH_RATE)
 
-        threading.Thread(target=buffer_frames, daemon=True).start()
-        while True:
-            try:
-                frame = q.get(block=True, timeout=5)
-                yield frame
-            except queue.Empty:
-                break
+        def iter_buffer():
+            while True:
+                try:
+                    frame_bytes = q.get(block=True, timeout=5)
+                except queue.Empty:
+                    break
+                if frame_bytes is None:
+                    self._frames_ended = True
+                    break
+                if isinstance(frame_bytes, Exception):
+                    raise frame_bytes
+                with buffered_bytes_lock:
+                    buffered_bytes[0] -= len(frame_bytes)
+                yield frame_bytes
+
+        start_thread(buffer_frames)
+        return iter_buffer()
 
     def _iter_frames_from_render(self):
         while True:
@@ -313,26 +446,44 @@ class TextVideo:
             if not frame_size_bytes:
                 break
             frame_size = int.from_bytes(frame_size_bytes, BYTE_ORDER)
-            frame_bytes = self.file_pointer.read(frame_size)
-            yield frame_bytes.decode("utf-8")
+            yield self.file_pointer.read(frame_size)
 
-    def change_font(self, font: ImageQueryFont):
-        """Change the font of the video.
+    def change_font(self, font: ImageQueryFont, distance_metric: str | None = None):
+        """Change the font (and optionally distance metric) of the video. When playing
+        from a cell cache, already buffered frames are converted again with the new font,
+        otherwise only the frames that are not buffered yet use it.
 
         Args:
             font (ImageQueryFont): New font to use.
+            distance_metric (str | None, optional): New distance metric to use.
+            Defaults to None (keep the current one).
         """
         self.font = font
+        if distance_metric is not None:
+            self.distance_metric = distance_metric
+        if self.from_cell_cache and not self._stopped:
+            self._frame_generator = self._iter_frames_from_video()
 
-    def next_frame(self):
+    def next_frame(self) -> str:
         """Get the next frame of the video.
 
         Returns:
             str: Next frame of the video.
         """
+        return self.next_frame_bytes().decode("utf-8")
+
+    def next_frame_bytes(self) -> bytes:
+        """Get the next frame of the video without decoding it.
+
+        Returns:
+            bytes: Next frame of the video (UTF-8 encoded).
+        """
         if self._stopped:
             raise ValueError("Video player has been stopped")
-        return next(self._frame_generator)
+        frame_bytes = next(self._frame_generator)
+        if not self.from_render:
+            self._frame_number += 1
+        return frame_bytes
 
     def stop(self):
         """Stop the video player (cannot be resumed)."""
@@ -340,35 +491,188 @@ class TextVideo:
             return
         if self.from_render:
             self.file_pointer.close()
+        else:
+            self._buffer_stop_event.set()
         if hasattr(self, "_video_chunk_handler"):
             self._video_chunk_handler.stop()
         self._stopped = True
 
-    def save(self, path: str):
-        """Function to save a video to a file.
+    def save_cell_cache(self, path: str):
+        """Function to save the resized frames (cell colors) of the video to a file.
+        The file can be opened as a video again and converted with any font or distance
+        metric at query speed, without decoding the original video.
+
+        Args:
+            path (str): Path to save the cell cache.
+        """
+        if self.from_render or self.from_cell_cache:
+            raise ValueError("Cell cache can only be created from a video file")
+        if self._stopped:
+            raise ValueError("Video player has been stopped")
+        # chunks are encoded with the priority they are created in
+        with scheduling_priority("background"):
+            self._buffer_stop_event.set()
+            self._video_chunk_handler.set_time(0)
+            frame_count = 0
+            with open(path, "wb") as file:
+                header = (CELL_CACHE_MAGIC_NUMBER, self.frame_rate, 0, *self.new_size)
+                for value in header:
+                    file.write(value.to_bytes(INT_SIZE, BYTE_ORDER))
+                for frame in self._video_chunk_handler.iter_frames():
+                    file.write(frame.tobytes())
+                    frame_count += 1
+                    if frame_count % self.frame_rate == 0:
+                        print(
+                            f"Cached {frame_count//self.frame_rate}/"
+                            + f"{self.video_length} seconds",
+                            end="\r",
+                        )
+                # frame count is only known at the end
+                file.seek(2 * INT_SIZE)
+                file.write(frame_count.to_bytes(INT_SIZE, BYTE_ORDER))
+        self.set_time(0)
+
+    def _render_manifest(self, start_time: int, end_time: float) -> dict:
+        stat = os.stat(self.video)
+        return {
+            "version": RENDER_MANIFEST_VERSION,
+            "video": os.path.abspath(self.video),
+            "video_size": stat.st_size,
+            "video_mtime": stat.st_mtime_ns,
+            "font": self.font.fingerprint(),
+            "frame_rate": self.frame_rate,
+            "size": list(self.new_size),
+            "distance_metric": self.distance_metric,
+            "color_mode": self.color_mode,
+            "dither": self.dither,
+            "start_time": start_time,
+            "end_time": end_time,
+        }
+
+    @staticmethod
+    def _load_checkpoint(path: str, manifest: dict) -> dict | None:
+        # checkpoint of an interrupted render of the same video with the same font
+        # and settings, whose temp file is still there
+        try:
+            with open(path + RENDER_MANIFEST_SUFFIX, "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+            if checkpoint["manifest"] != manifest:
+                return None
+            if os.path.getsize(path + ".tmp") < checkpoint["size"]:
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return checkpoint
+
+    @staticmethod
+    def _write_checkpoint(
+        path: str, manifest: dict, frame_count: int, size: int, complete: bool
+    ):
+        checkpoint = {
+            "manifest": manifest,
+            "frame_count": frame_count,
+            "size": size,
+            "complete": complete,
+        }
+        # written under a temporary name first, so a checkpoint is never partial
+        temp_path = path + RENDER_MANIFEST_SUFFIX + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(checkpoint, file)
+        os.replace(temp_path, path + RENDER_MANIFEST_SUFFIX)
+
+    def _save_frames(
+        self,
+        file: BinaryIO,
+        path: str,
+        manifest: dict,
+        frame_count: int,
+        start_time: int,
+        end_time: float | None,
+    ) -> int:
+        # checkpoints are only made at whole seconds (multiples of the chunk length),
+        # which is where the conversion can be started again by set time
+        with scheduling_priority("background"):
+            self.set_time(start_time + frame_count // self.frame_rate)
+        if end_time is None:
+            # the length of the video is only an estimate of its frame count, so up
+            # to the end it is rendered until the frames run out
+            max_frame_count = None
+            length = self.video_length - start_time
+        else:
+            max_frame_count = max(0, round((end_time - start_time) * self.frame_rate))
+            length = end_time - start_time
+        checkpoint_frames = self.chunk_length * self.frame_rate
+        for frame_bytes in itertools.islice(
+            self._frame_generator,
+            None if max_frame_count is None else max_frame_count - frame_count,
+        ):
+            file.write(len(frame_bytes).to_bytes(INT_SIZE, BYTE_ORDER))
+            file.write(frame_bytes)
+            frame_count += 1
+            if frame_count % checkpoint_frames == 0:
+                file.flush()
+                os.fsync(file.fileno())
+                self._write_checkpoint(path, manifest, frame_count, file.tell(), False)
+            if frame_count % self.frame_rate == 0:
+                print(
+                    f"Processed {frame_count//self.frame_rate}/"
+                    + f"{length:g} seconds",
+                    end="\r",
+                )
+        if not self._frames_ended and (
+            max_frame_count is None or frame_count < max_frame_count
+        ):
+            # the last good checkpoint is kept, so the render can be resumed
+            raise RuntimeError(f"Conversion stopped after {frame_count} frames")
+        # the assembly of the saved file can be repeated from the complete temp file
+        file.flush()
+        os.fsync(file.fileno())
+        self._write_checkpoint(path, manifest, frame_count, file.tell(), True)
+        return frame_count
+
+    def save(
+        self,
+        path: str,
+        start_time: int = 0,
+        end_time: int | None = None,
+        resume: bool = True,
+    ):
+        """Function to save a video (or only a segment of it) to a file. Segments of
+        a video rendered separately (e.g. on different machines) can be joined by merge.
+        Progress is checkpointed after every chunk length of frames, so an interrupted
+        render of the same video, font and settings continues from its last checkpoint.
 
         Args:
-            video_player (TextVideoPlayer): Video player to save.
             path (str): Path to save the video.
+            start_time (int, optional): Start of the segment in seconds. Defaults to 0.
+            end_time (int | None, optional): End of the segment in seconds (exclusive).
+            Defaults to None (end of the video).
+            resume (bool, optional): Whether to continue an interrupted render.
+            Defaults to True.
         """
-        if not hasattr(self, "_video_chunk_handler"):
+        if self.from_render:
             raise ValueError("Trying to save an already rendered video")
         if self._stopped:
             raise ValueError("Video player has been stopped")
-        self.set_time(0)
-        frame_count = 0
-        with open(path + ".tmp", "wb") as file:
-            for frame in self._frame_generator:
-                frame_bytes = frame.encode("utf-8")
-                file.write(len(frame_bytes).to_bytes(INT_SIZE, BYTE_ORDER))
-                file.write(frame_bytes)
-                frame_count += 1
-                if frame_count % self.frame_rate == 0:
-                    print(
-                        f"Processed {frame_count//self.frame_rate}/"
-                        + f"{self._video_chunk_handler.video_length} seconds",
-                        end="\r",
-                    )
+        if not 0 <= start_time < self.video_length:
+            raise ValueError(f"Start time is outside of the video: {start_time}")
+        if end_time is not None and end_time >= self.video_length:
+            end_time = None
+        manifest = self._render_manifest(start_time, end_time)
+        checkpoint = self._load_checkpoint(path, manifest) if resume else None
+        if checkpoint is None:
+            checkpoint = {"frame_count": 0, "size": 0, "complete": False}
+        frame_count = checkpoint["frame_count"]
+        if frame_count > 0:
+            print(f"Resuming from {frame_count // self.frame_rate} seconds")
+        with open(path + ".tmp", "r+b" if frame_count > 0 else "wb") as file:
+            # frames written after the last checkpoint are converted again
+            file.truncate(checkpoint["size"])
+            file.seek(checkpoint["size"])
+            if not checkpoint["complete"]:
+                frame_count = self._save_frames(
+                    file, path, manifest, frame_count, start_time, end_time
+                )
         with open(path, "wb") as file:
             file.write(TEXT_VIDEO_MAGIC_NUMBER.to_bytes(INT_SIZE, BYTE_ORDER))
             file.write(self.frame_rate.to_bytes(INT_SIZE, BYTE_ORDER))
@@ -387,3 +691,53 @@ class TextVideo:
                     file.write(frame_size.to_bytes(INT_SIZE, BYTE_ORDER))
                     file.write(frame)
             os.remove(path + ".tmp")
+        os.remove(path + RENDER_MANIFEST_SUFFIX)
+
+    @staticmethod
+    def merge(paths: list[str], path: str):
+        """Function to join saved videos (e.g. separately rendered segments of a video)
+        into a single saved video. Frames are copied as they are, only the frame
+        offset table is rewritten.
+
+        Args:
+            paths (list[str]): Paths of the saved videos in order.
+            path (str): Path to save the joined video.
+        """
+        frame_rate = None
+        headers = []
+        for segment_path in paths:
+            with open(segment_path, "rb") as file:
+                magic_number, segment_frame_rate, frame_count = (
+                    int.from_bytes(file.read(INT_SIZE), BYTE_ORDER) for _ in range(3)
+                )
+            if magic_number != TEXT_VIDEO_MAGIC_NUMBER:
+                raise ValueError(f"Not a saved video: {segment_path}")
+            if frame_rate is not None and segment_frame_rate != frame_rate:
+                raise ValueError(f"Frame rate of {segment_path} does not match")
+            frame_rate = segment_frame_rate
+            frames_offset = 3 * INT_SIZE + frame_count * INT_SIZE
+            frames_size = os.path.getsize(segment_path) - frames_offset
+            headers.append((frame_count, frames_offset, frames_size))
+        if frame_rate is None:
+            raise ValueError("No videos to merge")
+        total_frame_count = sum(header[0] for header in headers)
+        # frames of each segment are shifted by the new table and preceding segments
+        shift = 3 * INT_SIZE + total_frame_count * INT_SIZE
+        with open(path, "wb") as file:
+            file.write(TEXT_VIDEO_MAGIC_NUMBER.to_bytes(INT_SIZE, BYTE_ORDER))
+            file.write(frame_rate.to_bytes(INT_SIZE, BYTE_ORDER))
+            file.write(total_frame_count.to_bytes(INT_SIZE, BYTE_ORDER))
+            for segment_path, (frame_count, frames_offset, frames_size) in zip(
+                paths, headers
+            ):
+                with open(segment_path, "rb") as segment_file:
+                    segment_file.seek(3 * INT_SIZE)
+                    for _ in range(frame_count):
+                        offset = int.from_bytes(segment_file.read(INT_SIZE), BYTE_ORDER)
+                        offset += shift - frames_offset
+                        file.write(offset.to_bytes(INT_SIZE, BYTE_ORDER))
+                shift += frames_size
+            for segment_path, (_, frames_offset, _) in zip(paths, headers):
+                with open(segment_path, "rb") as segment_file:
+                    segment_file.seek(frames_offset)
+                    shutil.copyfileobj(segment_file, file)
@@ -0,0 +1,409 @@
+"""Module containing the Uni-Art GUI load test."""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+from werkzeug.serving import make_server
+
+import gui
+from image2text import get_system_fonts_paths
+from image2text.constants import SYSTEM_FONT_PATH
+
+ROUTES = ("/set_font", "/set_media", "/get_frame", "/set_time")
+REQUEST_TIMEOUT = 120  # seconds
+MEMORY_SAMPLE_INTERVAL = 0.5  # seconds
+MEDIA_SIZE = (320, 180)  # width, height of the generated media
+MEDIA_FRAME_RATE = 30
+MEDIA_FRAME_COUNT = 150
+# font settings switched between by the font switchers, color changes only recolor
+# the font, render size changes load it again
+FONT_VARIANTS = (
+    {"textColor": [0, 0, 0], "backgroundColor": [255, 255, 255], "renderSize": 24},
+    {"textColor": [255, 255, 255], "backgroundColor": [0, 0, 0], "renderSize": 24},
+    {"textColor": [0, 0, 0], "backgroundColor": [255, 255, 255], "renderSize": 32},
+)
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--url", help="URL of a running GUI server (default: start one on localhost)"
+    )
+    parser.add_argument(
+        "--players", type=int, help="Number of clients fetching frames", default=4
+    )
+    parser.add_argument(
+        "--seekers", type=int, help="Number of clients seeking the media", default=1
+    )
+    parser.add_argument(
+        "--font-switchers",
+        type=int,
+        help="Number of clients switching the font",
+        default=1,
+    )
+    parser.add_argument(
+        "--duration", type=float, help="Length of the test in seconds", default=10.0
+    )
+    parser.add_argument(
+        "--fps", type=float, help="Frames per second fetched by each player", default=10
+    )
+    parser.add_argument(
+        "--seek-interval", type=float, help="Seconds between seeks", default=1.0
+    )
+    parser.add_argument(
+        "--switch-interval", type=float, help="Seconds between font switches", default=3
+    )
+    parser.add_argument(
+        "--seek-range",
+        type=int,
+        help="Seeks go to a random second below this (default: length of the"
+        + " generated media)",
+        default=MEDIA_FRAME_COUNT // MEDIA_FRAME_RATE,
+    )
+    parser.add_argument("--font", help="Font file (default: a system font)")
+    parser.add_argument("--media", help="Media file (default: generated media)")
+    parser.add_argument(
+        "--media-type",
+        choices=["image", "animation", "video"],
+        help="Type of the generated media, video requires FFmpeg",
+        default="animation",
+    )
+    parser.add_argument("--char-count", type=int, help="Character count", default=2000)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    if args.media is None and args.media_type == "video" and not shutil.which("ffmpeg"):
+        parser.error("generated video media requires FFmpeg")
+    return args
+
+
+class LoadStats:
+    """Class to store latencies and errors of the requests of all clients."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {route: [] for route in ROUTES}
+        self.errors: dict[str, Counter] = {route: Counter() for route in ROUTES}
+        self.memory: list[int] = []
+
+    def record(self, route: str, latency: float, error: str | None):
+        """Record a finished request."""
+        with self.lock:
+            self.latencies[route].append(latency)
+            if error is not None:
+                self.errors[route][error] += 1
+
+
+def find_font() -> str:
+    """Find a system font to test with, monospace fonts are preferred."""
+    fonts = get_system_fonts_paths()
+    if not fonts:
+        for root, _, files in os.walk(SYSTEM_FONT_PATH):
+            fonts += [
+                os.path.join(root, file)
+                for file in files
+                if file.endswith((".ttf", ".otf"))
+            ]
+    if not fonts:
+        raise SystemExit("No system font found, use --font")
+    return min(fonts, key=lambda path: ("mono" not in path.lower(), len(path), path))
+
+
+def generate_media(directory: str, media_type: str) -> str:
+    """Generate a moving color gradient as an image, animated GIF or video."""
+    width, height = MEDIA_SIZE
+    x = np.linspace(0, 1, width)[None, :]
+    y = np.linspace(0, 1, height)[:, None]
+    frames = []
+    for i in range(1 if media_type == "image" else MEDIA_FRAME_COUNT):
+        phase = 2 * np.pi * i / MEDIA_FRAME_COUNT
+        channels = np.broadcast_arrays(
+            (np.sin(2 * np.pi * x + phase) + 1) / 2,
+            y,
+            (np.cos(2 * np.pi * (x + y) + phase) + 1) / 2,
+        )
+        frames.append((np.stack(channels, axis=-1) * 255).astype(np.uint8))
+    match media_type:
+        case "image":
+            path = os.path.join(directory, "loadtest.png")
+            Image.fromarray(frames[0]).save(path)
+        case "animation":
+            path = os.path.join(directory, "loadtest.gif")
+            images = [Image.fromarray(frame) for frame in frames]
+            images[0].save(
+                path,
+                save_all=True,
+                append_images=images[1:],
+                duration=1000 // MEDIA_FRAME_RATE,
+                loop=0,
+            )
+        case _:
+            # cv2 is only needed for generated videos
+            import cv2  # pylint: disable=import-outside-toplevel
+
+            path = os.path.join(directory, "loadtest.mp4")
+            writer = cv2.VideoWriter(
+                path, cv2.VideoWriter_fourcc(*"mp4v"), MEDIA_FRAME_RATE, MEDIA_SIZE
+            )
+            for frame in frames:
+                writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            writer.release()
+    return path
+
+
+def font_settings(font: str, variant: dict) -> dict:
+    """Settings of the /set_font route."""
+    return {
+        "font": font,
+        "charset": "ascii",
+        "embeddedColor": False,
+        "kerning": True,
+        "ligatures": False,
+        "forceMonospace": False,
+        "shapeGrid": 1,
+    } | variant
+
+
+def request_json(
+    base_url: str, route: str, stats: LoadStats, data: dict | None = None
+) -> dict | None:
+    """Send a request (POST with JSON data if given) and record its latency and error.
+
+    Returns:
+        dict | None: Response of the server, None if the request failed.
+    """
+    request = urllib.request.Request(base_url + route)
+    if data is not None:
+        request.data = json.dumps(data).encode("utf-8")
+        request.add_header("Content-Type", "application/json")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            result = json.load(response)
+        error = None if result.get("success", True) else result.get("error")
+    except urllib.error.HTTPError as e:
+        result, error = None, f"HTTP {e.code}"
+    except (OSError, ValueError) as e:
+        result, error = None, type(e).__name__
+    if route in ROUTES:
+        stats.record(route, time.perf_counter() - start, error)
+    return result
+
+
+def run_player(base_url: str, stats: LoadStats, fps: float, end: float) -> int:
+    """Fetch frames at the target frame rate, returns the number of frames received."""
+    interval = 1 / fps
+    next_time = time.perf_counter()
+    frames = 0
+    while next_time < end:
+        result = request_json(base_url, "/get_frame", stats, {})
+        if result is not None and result["success"]:
+            frames += 1
+        elif result is not None and result["error"] == "End of video reached":
+            request_json(base_url, "/set_time", stats, {"time": 0})
+        # late frames are not caught up in a burst, like a real player does
+        next_time = max(next_time + interval, time.perf_counter() - interval)
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+    return frames
+
+
+def run_seeker(
+    base_url: str, stats: LoadStats, interval: float, seek_range: int, end: float
+):
+    """Seek to random times of the media."""
+    while time.perf_counter() + interval < end:
+        time.sleep(interval)
+        request_json(
+            base_url, "/set_time", stats, {"time": random.randrange(max(1, seek_range))}
+        )
+
+
+def run_font_switcher(
+    base_url: str, stats: LoadStats, interval: float, font: str, end: float
+):
+    """Switch between the font variants."""
+    variant = 0
+    while time.perf_counter() + interval < end:
+        time.sleep(interval)
+        variant = (variant + 1) % len(FONT_VARIANTS)
+        request_json(
+            base_url, "/set_font", stats, font_settings(font, FONT_VARIANTS[variant])
+        )
+
+
+def sample_memory(base_url: str, stats: LoadStats, stop_event: threading.Event):
+    """Sample the resident memory of the server until stopped."""
+    while not stop_event.is_set():
+        result = request_json(base_url, "/server_stats", stats)
+        if result is not None and result["memory"] is not None:
+            stats.memory.append(result["memory"])
+        stop_event.wait(MEMORY_SAMPLE_INTERVAL)
+
+
+def run_load_test(args, base_url: str, font: str, media: str) -> dict:
+    """Set up the player and run all the clients, returns the report."""
+    stats = LoadStats()
+    stop_event = threading.Event()
+    sampler = threading.Thread(target=sample_memory, args=(base_url, stats, stop_event))
+    sampler.start()
+    try:
+        result = request_json(
+            base_url, "/set_font", stats, font_settings(font, FONT_VARIANTS[0])
+        )
+        if result is None or not result["success"]:
+            raise SystemExit(f"Setting the font failed: {result}")
+        result = request_json(
+            base_url,
+            "/set_media",
+            stats,
+            {
+                "media": os.path.abspath(media),
+                "characterCount": args.char_count,
+                "rowSpacing": 1.0,
+                "distanceMetric": "manhattan",
+                "frameRate": MEDIA_FRAME_RATE,
+                "chunkLength": 5,
+                "bufferSize": 100,
+            },
+        )
+        if result is None or not result["success"]:
+            raise SystemExit(f"Setting the media failed: {result}")
+        start = time.perf_counter()
+        end = start + args.duration
+        frame_counts = [0] * args.players
+
+        def player(index: int):
+            frame_counts[index] = run_player(base_url, stats, args.fps, end)
+
+        threads = [
+            threading.Thread(target=player, args=(i,)) for i in range(args.players)
+        ]
+        threads += [
+            threading.Thread(
+                target=run_seeker,
+                args=(base_url, stats, args.seek_interval, args.seek_range, end),
+            )
+            for _ in range(args.seekers)
+        ]
+        threads += [
+            threading.Thread(
+                target=run_font_switcher,
+                args=(base_url, stats, args.switch_interval, font, end),
+            )
+            for _ in range(args.font_switchers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+    finally:
+        stop_event.set()
+        sampler.join()
+    return make_report(stats, frame_counts, duration)
+
+
+def make_report(stats: LoadStats, frame_counts: list[int], duration: float) -> dict:
+    """Latency percentiles and error rates of each route, frame rates of the players
+    and memory of the server."""
+    routes = {}
+    for route in ROUTES:
+        latencies = np.array(stats.latencies[route]) * 1000
+        errors = stats.errors[route]
+        num_errors = sum(errors.values())
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": num_errors,
+            "error_rate": num_errors / len(latencies) if len(latencies) else 0.0,
+            "error_messages": dict(errors.most_common(5)),
+        } | {
+            f"{name}_ms": float(np.percentile(latencies, q)) if len(latencies) else 0.0
+            for name, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+        }
+    memory = None
+    if stats.memory:
+        memory = {
+            "start_mb": stats.memory[0] / 2**20,
+            "max_mb": max(stats.memory) / 2**20,
+            "end_mb": stats.memory[-1] / 2**20,
+        }
+    return {
+        "duration": duration,
+        "routes": routes,
+        "player_fps": [count / duration for count in frame_counts],
+        "server_memory": memory,
+    }
+
+
+def print_report(report: dict):
+    """Print the report as tables."""
+    print(f"Duration: {report['duration']:.1f} s")
+    print(
+        f"{'route':<11}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p90 ms':>9}"
+        + f"{'p99 ms':>9}{'max ms':>9}"
+    )
+    for route, route_stats in report["routes"].items():
+        print(
+            f"{route:<11}{route_stats['requests']:>9}"
+            + f"{route_stats['error_rate']:>8.1%}{route_stats['p50_ms']:>9.1f}"
+            + f"{route_stats['p90_ms']:>9.1f}{route_stats['p99_ms']:>9.1f}"
+            + f"{route_stats['max_ms']:>9.1f}"
+        )
+        for message, count in route_stats["error_messages"].items():
+            print(f"    {count} x {message}")
+    fps = report["player_fps"]
+    if fps:
+        print(
+            "Player fps: "
+            + ", ".join(f"{value:.1f}" for value in fps)
+            + f" (mean {np.mean(fps):.1f})"
+        )
+    memory = report["server_memory"]
+    if memory is None:
+        print("Server memory: unknown")
+    else:
+        print(
+            f"Server memory: {memory['start_mb']:.0f} MB at start,"
+            + f" {memory['max_mb']:.0f} MB max, {memory['end_mb']:.0f} MB at end"
+        )
+
+
+def main():
+    """Main function of the load test."""
+    args = parse_args()
+    font = args.font or find_font()
+    server = None
+    base_url = args.url
+    with tempfile.TemporaryDirectory(prefix="uni_art_loadtest_") as directory:
+        media = args.media or generate_media(directory, args.media_type)
+        if base_url is None:
+            # the app is served in this process on a free port, without request logs
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            server = make_server("127.0.0.1", 0, gui.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            report = run_load_test(args, base_url.rstrip("/"), font, media)
+        finally:
+            if server is not None:
+                server.shutdown()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,10 @@ document.addEventListener('DOMContentLoaded', function () {
         fontLigatures = document.getElementById('font-ligatures'),
         fontForceMonospace = document.getElementById('font-force-monospace'),
         fontRenderSize = document.getElementById('font-render-size'),
+        fontShapeGrid = document.getElementById('font-shape-grid'),
+        fontPruneTolerance = document.getElementById('font-prune-tolerance'),
+        fontMaxGlyphs = document.getElementById('font-max-glyphs'),
+        fontPrunePriority = document.getElementById('font-prune-priority'),
         fontSetButton = document.getElementById('font-set-button'),
         fontInfo = document.getElementById('selected-font'),
         mediaSource = document.getElementById('media-source'),
@@ -23,6 +27,7 @@ document.addEventListener('DOMContentLoaded', function () {
         mediaBufferSize = document.getElementById('media-buffer-size'),
         mediaSetButton = document.getElementById('media-set-button'),
         mediaInfo = document.getElementById('selected-media'),
+        mediaPreview = document.getElementById('media-preview'),
         playerTextSize = document.getElementById('player-text-size'),
         playerCurrentTime = document.getElementById('player-current-time'),
         playerJumpTime = document.getElementById('player-jump-time'),
@@ -41,6 +46,10 @@ document.addEventListener('DOMContentLoaded', function () {
         selectedLigatures = fontLigatures.checked,
         selectedForceMonospace = fontForceMonospace.checked,
         selectedRenderSize = fontRenderSize.value,
+        selectedShapeGrid = fontShapeGrid.value,
+        selectedPruneTolerance = fontPruneTolerance.value,
+        selectedMaxGlyphs = fontMaxGlyphs.value,
+        selectedPrunePriority = fontPrunePriority.value,
         selectedCharacterCount = mediaCharacterCount.value,
         selectedRowSpacing = mediaRowSpacing.value,
         selectedDistanceMetric = mediaDistanceMetric.value,
@@ -52,6 +61,11 @@ document.addEventListener('DOMContentLoaded', function () {
         playerFrame = 0,
         playerIsPlaying = false,
         playerIntervalId = null,
+        fontProgressTimeoutId = null,
+        mediaPreviews = {},
+        mediaPreviewFrame = 0,
+        mediaPreviewIntervalId = null,
+        mediaLoadTimeoutId = null,
         displayFontFace = null;
 
 
@@ -125,18 +139,54 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     function loadMedia() {
+        clearTimeout(mediaLoadTimeoutId);
         fetch('/get_media')
             .then(response => response.json())
             .then(data => {
-                for (const font of data) {
+                const selectedMedia = mediaSource.value;
+                while (mediaSource.options.length > 1) {
+                    mediaSource.remove(1);
+                }
+                mediaPreviews = {};
+                for (const media of data) {
                     mediaSource.insertAdjacentHTML(
                         'beforeend',
-                        `<option value="${font}">${font.split('/').at(-1)}</option>`
+                        `<option value="${media.path}">${media.path.split('/').at(-1)}</option>`
                     );
+                    mediaPreviews[media.path] = media.preview;
+                }
+                if (selectedMedia in mediaPreviews) {
+                    mediaSource.value = selectedMedia;
+                }
+                showMediaPreview();
+                // previews are converted in the background, so the list is loaded again
+                if (data.some(media => media.preview && media.preview.status === 'pending')) {
+                    mediaLoadTimeoutId = setTimeout(loadMedia, 1000);
                 }
             });
     }
 
+    function showMediaPreview() {
+        clearInterval(mediaPreviewIntervalId);
+        const preview = mediaPreviews[mediaSource.value];
+        if (!preview) {
+            mediaPreview.textContent = 'None';
+        } else if (preview.status === 'pending') {
+            mediaPreview.textContent = 'converting preview...';
+        } else if (preview.status === 'failed') {
+            mediaPreview.textContent = 'No preview: ' + preview.error;
+        } else {
+            mediaPreviewFrame = 0;
+            mediaPreview.textContent = preview.frames[0];
+            if (preview.frames.length > 1) {
+                mediaPreviewIntervalId = setInterval(function () {
+                    mediaPreviewFrame = (mediaPreviewFrame + 1) % preview.frames.length;
+                    mediaPreview.textContent = preview.frames[mediaPreviewFrame];
+                }, 1000);
+            }
+        }
+    }
+
     function otherMediaInput() {
         if (mediaSource.value === '<other-media>') {
             mediaOtherLabel.classList.remove('hide');
@@ -163,7 +213,12 @@ document.addEventListener('DOMContentLoaded', function () {
         selectedLigatures = fontLigatures.checked;
         selectedForceMonospace = fontForceMonospace.checked;
         selectedRenderSize = fontRenderSize.value;
+        selectedShapeGrid = fontShapeGrid.value;
+        selectedPruneTolerance = fontPruneTolerance.value;
+        selectedMaxGlyphs = fontMaxGlyphs.value;
+        selectedPrunePriority = fontPrunePriority.value;
         fontSetButton.disabled = true;
+        clearTimeout(fontProgressTimeoutId);
 
         infoConsole.textContent = 'loading font...'
         fetch('/set_font', {
@@ -180,7 +235,11 @@ document.addEventListener('DOMContentLoaded', function () {
                 kerning: selectedKerning,
                 ligatures: selectedLigatures,
                 forceMonospace: selectedForceMonospace,
-                renderSize: selectedRenderSize
+                renderSize: selectedRenderSize,
+                shapeGrid: selectedShapeGrid,
+                pruneTolerance: selectedPruneTolerance,
+                maxGlyphs: selectedMaxGlyphs,
+                prunePriority: selectedPrunePriority
             })
         })
             .then(response => response.json())
@@ -192,7 +251,7 @@ document.addEventListener('DOMContentLoaded', function () {
                         selectedTextColor
                     )}), (${hexToRgb(
                         selectedBackgroundColor
-                    )}), ${selectedEmbeddedColor}, ${selectedKerning}, ${selectedLigatures}, ${selectedForceMonospace}, ${selectedRenderSize})`;
+                    )}), ${selectedEmbeddedColor}, ${selectedKerning}, ${selectedLigatures}, ${selectedForceMonospace}, ${selectedRenderSize}, ${selectedShapeGrid})`;
                     display.style.color = `${selectedTextColor}`;
                     const fontBytes = atob(data.fontData);
                     const fontArray = new Uint8Array(fontBytes.length);
@@ -203,12 +262,17 @@ document.addEventListener('DOMContentLoaded', function () {
                     displayFontFace.load().then(function (loadedFont) {
                         document.fonts.add(loadedFont);
                         display.style.fontFamily = 'displayFont'
+                        mediaPreview.style.fontFamily = 'displayFont'
                     })
                     changeBackground();
                     if (mediaType === 'image') {
                         updateFrame();
                     }
                     fontSet = true;
+                    loadMedia();
+                    if (!data.complete) {
+                        fontProgressTimeoutId = setTimeout(updateFontProgress, 500);
+                    }
                 } else {
                     infoConsole.textContent = 'Error setting font: ' + data.error;
                 }
@@ -216,6 +280,27 @@ document.addEventListener('DOMContentLoaded', function () {
             })
     }
 
+    function updateFontProgress() {
+        fetch('/font_progress')
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    infoConsole.textContent = 'Error loading font: ' + data.error;
+                } else if (data.complete) {
+                    infoConsole.textContent =
+                        'Font loaded completely, loaded characters ' + data.loadedChars;
+                    if (mediaType === 'image') {
+                        updateFrame();
+                    }
+                    loadMedia();
+                } else {
+                    infoConsole.textContent =
+                        `Loading font in the background, rendered glyphs ${data.loaded}/${data.total}`;
+                    fontProgressTimeoutId = setTimeout(updateFontProgress, 500);
+                }
+            })
+    }
+
     function ChangeMedia() {
         if (!fontSet) {
             infoConsole.textContent = 'Please select a font first';
@@ -339,6 +424,7 @@ document.addEventListener('DOMContentLoaded', function () {
     loadMedia();
     fontSource.addEventListener('change', otherFontInput);
     mediaSource.addEventListener('change', otherMediaInput);
+    mediaSource.addEventListener('change', showMediaPreview);
     optionsToggleButton.addEventListener('click', optionsToggleHide);
     hintToggleButton.addEventListener('click', hintToggleHide);
     fontSetButton.addEventListener('click', changeFont);
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from image2text import ImageQueryFont
+
+FONT_DIR = "/usr/share/fonts/truetype/dejavu/"
+ASCII = set(chr(i) for i in range(32, 127))
+
+
+def load_font(name: str, **kwargs) -> ImageQueryFont:
+    path = os.path.join(FONT_DIR, name)
+    if not os.path.isfile(path):
+        pytest.skip(f"font not installed: {path}")
+    return ImageQueryFont(path, ASCII, use_ligatures=False, **kwargs)
+
+
+@pytest.fixture(scope="session")
+def mono_font():
+    return load_font("DejaVuSansMono.ttf")
+
+
+@pytest.fixture(scope="session")
+def proportional_font():
+    return load_font("DejaVuSans.ttf")
+
+
+@pytest.fixture(scope="session")
+def shape_font():
+    return load_font("DejaVuSansMono.ttf", shape_grid=2)
@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("font", ["mono_font", "proportional_font", "shape_font"])
+def test_ordered_dither_batch_matches_single_query(font, request):
+    font = request.getfixturevalue(font)
+    rng = np.random.default_rng(0)
+    # 61 rows of cells, not a multiple of the Bayer matrix size
+    grid = font.shape_grid
+    frames = rng.integers(0, 256, (3, 61 * grid, 40 * grid, 3), dtype=np.uint8)
+    expected = [font.query(frame, dither="ordered") for frame in frames]
+    assert font.query_batch(frames, dither="ordered") == expected
+    assert font.query_batch(list(frames), dither="ordered") == expected
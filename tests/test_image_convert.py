@@ -0,0 +1,19 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from image2text import TextImage
+
+
+def test_stream_matches_text_image(mono_font, tmp_path):
+    y, x = np.mgrid[0:300, 0:500]
+    gradient = np.dstack([x / 500 * 255, y / 300 * 255, (x + y) / 800 * 255])
+    for name in ("gradient.png", "gradient.jpg"):
+        path = str(tmp_path / name)
+        Image.fromarray(gradient.astype(np.uint8)).save(path)
+        output = io.BytesIO()
+        TextImage.stream(mono_font, path, output, 2000, header=False)
+        assert (
+            output.getvalue().decode("utf-8") == TextImage(mono_font, path, 2000).text
+        )
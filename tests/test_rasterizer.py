@@ -0,0 +1,17 @@
+import numpy as np
+
+from image2text import TextRasterizer
+
+
+def test_overlapping_glyphs_are_composited(proportional_font):
+    rasterizer = TextRasterizer(proportional_font)
+    font = proportional_font
+    # the kerning of the pair moves the second glyph box over the first one
+    assert font.kerning.get("AV", 0) < 0
+    canvas = rasterizer.rasterize("A\u200aV")
+    background = np.all(canvas == font.bg_color, axis=2)
+    for char, offset in (("A", 0), ("V", font.char_widths["A"] + font.kerning["AV"])):
+        glyph = rasterizer.glyphs[rasterizer.char_index[char] - 1]
+        x = font.units_to_pixels(offset)
+        ink = ~np.all(glyph == font.bg_color, axis=2)
+        assert not background[:, x : x + glyph.shape[1]][ink].any()
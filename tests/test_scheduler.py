@@ -0,0 +1,46 @@
+import subprocess
+import threading
+
+import pytest
+
+from image2text.scheduler import ResourceScheduler, get_scheduler, set_scheduler
+from image2text.video_convert import VideoChunk
+
+
+@pytest.fixture
+def scheduler():
+    previous = get_scheduler()
+    scheduler = ResourceScheduler(4)
+    set_scheduler(scheduler)
+    yield scheduler
+    set_scheduler(previous)
+
+
+def test_query_starts_while_chunk_is_encoded(scheduler, monkeypatch):
+    encoding = threading.Event()
+    finish = threading.Event()
+
+    def run(*args, **kwargs):
+        encoding.set()
+        finish.wait(5)
+
+    monkeypatch.setattr(subprocess, "run", run)
+    chunk = VideoChunk("video.mp4", 0, 1, 30, (80, 40))
+    thread = threading.Thread(target=chunk.process)
+    thread.start()
+    try:
+        assert encoding.wait(5)
+        assert scheduler.stats()["long_running"] == 2
+        queried = threading.Event()
+
+        def query():
+            with scheduler.reserve(1):
+                queried.set()
+
+        threading.Thread(target=query, daemon=True).start()
+        assert queried.wait(1)
+    finally:
+        finish.set()
+        thread.join()
+        chunk.delete()
+    assert scheduler.stats()["long_running"] == 0